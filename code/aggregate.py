@@ -0,0 +1,228 @@
+# streaming aggregation of replica regrets
+# workers feed regrets as they finish, and partial aggregates from
+# different processes merge, so memory does not grow with the replicas
+
+import math
+from functools import lru_cache
+import numpy as np
+
+# normal quantile of the default two-sided 95% interval
+Z95 = 1.959963984540054
+
+class RunningStats:
+  """Welford running mean and variance, elementwise over arrays"""
+  def __init__(self):
+    self.count = 0
+    self.mean = 0.0
+    self.m2 = 0.0
+
+  def add(self, value):
+    value = np.asarray(value, dtype=float)
+    self.count += 1
+    delta = value - self.mean
+    self.mean = self.mean + delta / self.count
+    self.m2 = self.m2 + delta * (value - self.mean)
+
+  def merge(self, other):
+    # Chan et al. pairwise combination
+    if other.count == 0:
+      return self
+    total = self.count + other.count
+    delta = other.mean - self.mean
+    self.mean = self.mean + delta * other.count / total
+    self.m2 = self.m2 + other.m2 + delta ** 2 * self.count * other.count / total
+    self.count = total
+    return self
+
+  def variance(self):
+    return self.m2 / (self.count - 1) if self.count > 1 else np.zeros_like(self.mean)
+
+  def std(self):
+    return np.sqrt(self.variance())
+
+  def interval(self, z=Z95):
+    """confidence interval of the mean, z standard errors wide"""
+    half = z * self.std() / math.sqrt(max(self.count, 1))
+    return self.mean - half, self.mean + half
+
+class QuantileSketch:
+  """mergeable quantile sketch (a compactor hierarchy, as in KLL)
+  each level holds at most k values, a full level is sorted and every
+  other value moves up a level with twice the weight
+  """
+  def __init__(self, k=128):
+    self.k = k
+    self.levels = [[]]
+    self.count = 0
+    # alternating offset of the values that move up keeps ranks unbiased
+    self.offset = 0
+
+  def add(self, value):
+    self.levels[0].append(float(value))
+    self.count += 1
+    if len(self.levels[0]) >= self.k:
+      self.compress()
+
+  def compress(self):
+    h = 0
+    while h < len(self.levels):
+      if len(self.levels[h]) >= self.k:
+        if h + 1 == len(self.levels):
+          self.levels.append([])
+        items = sorted(self.levels[h])
+        # an odd value out stays behind at this level
+        rest = [items.pop()] if len(items) % 2 else []
+        self.levels[h + 1].extend(items[self.offset::2])
+        self.offset ^= 1
+        self.levels[h] = rest
+      h += 1
+
+  def merge(self, other):
+    while len(self.levels) < len(other.levels):
+      self.levels.append([])
+    for h, items in enumerate(other.levels):
+      self.levels[h].extend(items)
+    self.count += other.count
+    self.compress()
+    return self
+
+  def quantile(self, q):
+    """approximate q-quantiles (q may be an array of values in [0, 1])"""
+    values = np.array([v for items in self.levels for v in items])
+    weights = np.array([2 ** h for h, items in enumerate(self.levels) for v in items], dtype=float)
+    if len(values) == 0:
+      return np.full(np.shape(q), np.nan)
+    order = np.argsort(values)
+    ranks = np.cumsum(weights[order]) / weights.sum()
+    index = np.minimum(np.searchsorted(ranks, q), len(values) - 1)
+    return values[order][index]
+
+class RegretAggregate:
+  """running stats and quantile sketches of the regret at each checkpoint"""
+  def __init__(self, checkpoints, k=128):
+    self.checkpoints = list(checkpoints)
+    self.stats = RunningStats()
+    self.sketches = [QuantileSketch(k) for _ in self.checkpoints]
+
+  def add(self, regrets):
+    regrets = np.atleast_1d(regrets)
+    self.stats.add(regrets)
+    for sketch, regret in zip(self.sketches, regrets):
+      sketch.add(regret)
+
+  def merge(self, other):
+    self.stats.merge(other.stats)
+    for sketch, theirs in zip(self.sketches, other.sketches):
+      sketch.merge(theirs)
+    return self
+
+  def quantiles(self, qs=(0.05, 0.5, 0.95)):
+    """array of shape (len(qs), len(checkpoints))"""
+    return np.array([sketch.quantile(qs) for sketch in self.sketches]).T
+
+  def summary(self):
+    low, high = self.stats.interval()
+    q05, q50, q95 = self.quantiles()
+    return {
+      'checkpoints': self.checkpoints,
+      'replicas': self.stats.count,
+      'mean': np.atleast_1d(self.stats.mean).tolist(),
+      'std': np.atleast_1d(self.stats.std()).tolist(),
+      'ci_low': np.atleast_1d(low).tolist(),
+      'ci_high': np.atleast_1d(high).tolist(),
+      'p05': q05.tolist(),
+      'median': q50.tolist(),
+      'p95': q95.tolist(),
+    }
+
+def incomplete_beta(x, a, b):
+  """regularised incomplete beta function I_x(a, b), by its continued
+  fraction (modified Lentz)
+  """
+  if x <= 0 or x >= 1:
+    return float(x >= 1)
+  if x > (a + 1) / (a + b + 2):
+    # the fraction converges fast only below the mean
+    return 1 - incomplete_beta(1 - x, b, a)
+  front = math.exp(math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b)
+    + a * math.log(x) + b * math.log(1 - x)) / a
+  tiny = 1e-300
+  c, d = 1.0, 1 - (a + b) * x / (a + 1)
+  d = 1 / (d if abs(d) > tiny else tiny)
+  f = d
+  for m in range(1, 300):
+    for numerator in (m * (b - m) * x / ((a + 2 * m - 1) * (a + 2 * m)),
+        -(a + m) * (a + b + m) * x / ((a + 2 * m) * (a + 2 * m + 1))):
+      d = 1 + numerator * d
+      d = 1 / (d if abs(d) > tiny else tiny)
+      c = 1 + numerator / c
+      c = c if abs(c) > tiny else tiny
+      f *= c * d
+    if abs(c * d - 1) < 1e-12:
+      break
+  return front * f
+
+@lru_cache(maxsize=None)
+def t_quantile(p, df):
+  """p-quantile (p > 1/2) of Student's t with df degrees of freedom, by
+  bisection on its upper tail 1/2 I_{df / (df + t^2)}(df / 2, 1 / 2)
+  """
+  tail = 1 - p
+  lo, hi = 0.0, 1.0
+  while incomplete_beta(df / (df + hi * hi), df / 2, 0.5) / 2 > tail:
+    lo, hi = hi, 2 * hi
+  for _ in range(60):
+    mid = (lo + hi) / 2
+    if incomplete_beta(df / (df + mid * mid), df / 2, 0.5) / 2 > tail:
+      lo = mid
+    else:
+      hi = mid
+  return hi
+
+class SequentialTest:
+  """sequential test of the mean regret against a threshold
+  at the k-th look the mean's Student-t interval (count - 1 degrees of
+  freedom) has level 1 - alpha_k, with alpha_k = (1 - confidence) 6 /
+  (pi^2 k^2), and the test decides once it lies entirely below or above the
+  threshold; the looks together err with probability at most
+  1 - confidence only as far as each t interval is exact, which for the
+  right-skewed regret of a bandit it is not, so the confidence is nominal
+  and min_sims keeps the variance estimate from resting on a handful of
+  replicas
+  """
+  def __init__(self, threshold, confidence=0.95, min_sims=10):
+    self.threshold = threshold
+    self.confidence = confidence
+    self.min_sims = min_sims
+    self.stats = RunningStats()
+    self.looks = 0
+    # 'below' or 'above' once decided
+    self.decision = None
+
+  def add(self, regret):
+    self.stats.add(regret)
+
+  def look(self):
+    """checks the bound with the replicas so far, returns the decision"""
+    if self.decision is not None or self.stats.count < self.min_sims:
+      return self.decision
+    self.looks += 1
+    alpha = (1 - self.confidence) * 6 / (math.pi ** 2 * self.looks ** 2)
+    low, high = self.stats.interval(t_quantile(1 - alpha / 2, self.stats.count - 1))
+    if high < self.threshold:
+      self.decision = 'below'
+    elif low > self.threshold:
+      self.decision = 'above'
+    return self.decision
+
+  def mean(self):
+    return float(self.stats.mean)
+
+  def replicas(self):
+    return self.stats.count
+
+  def passed(self):
+    """below the threshold: decided so, or by the mean if undecided"""
+    if self.decision is not None:
+      return self.decision == 'below'
+    return self.mean() <= self.threshold
@@ -1,10 +1,23 @@
 import argparse, time
-from simulator import simulate, batch_simulate
-from task1 import Algorithm, Eps_Greedy, UCB, KL_UCB, Thompson_Sampling
+from functools import partial
+import numpy as np
+from simulator import STEP_COST, simulate, batch_simulate, multi_simulate, replica_seeds, schedule_sims, share_probs, single_sim, single_batch_sim
+from task1 import UCB, KL_UCB, Thompson_Sampling
 from task2 import AlgorithmBatched
 from task3 import AlgorithmManyArms
 
 FACTOR = 1.5
+# task1 algorithms: name, policy, replicas and the Testcase field with the
+# reference regret
+TASK1_ALGOS = {
+    'ucb': ('UCB', UCB, 50, 'ucb'),
+    'kl_ucb': ('KL-UCB', KL_UCB, 20, 'kl_ucb'),
+    'thompson': ('Thompson Sampling', Thompson_Sampling, 50, 'thompson'),
+}
+# grade_task* stop adding replicas once a t interval at this (nominal)
+# confidence clears the threshold, see aggregate.SequentialTest
+SEQUENTIAL = True
+CONFIDENCE = 0.95
 
 class Testcase:
     def __init__(self, task, probs, horizon, batch_size):
@@ -44,75 +57,175 @@ def read_tc(path):
             
     return tc
 
+def grade(run, reference, num_sims):
+    """score, mean regret and replicas used of one simulation
+    with SEQUENTIAL, replicas stop once the verdict is clear at CONFIDENCE,
+    num_sims is then only the cap
+    """
+    if not SEQUENTIAL:
+        regret = run(num_sims=num_sims)
+        return (1 if regret <= reference * FACTOR else 0), regret, num_sims
+    test = run(num_sims=num_sims, threshold=reference * FACTOR, confidence=CONFIDENCE)
+    return int(test.passed()), test.mean(), test.replicas()
+
 def grade_task1(tc_path, algo):
     algo = algo.lower()
     tc = read_tc(tc_path)
     regrets = {}
     scores = {}
-    if algo == 'ucb' or algo == 'all':
-        regrets['UCB'] = simulate(UCB, tc.probs, tc.horizon)
-        scores['UCB'] = 1 if regrets['UCB'] <= tc.ucb * FACTOR else 0
-    if algo == 'kl_ucb' or algo == 'all':
-        regrets['KL-UCB'] = simulate(KL_UCB, tc.probs, tc.horizon, num_sims=20)
-        scores['KL-UCB'] = 1 if regrets['KL-UCB'] <= tc.kl_ucb * FACTOR else 0
-    if algo == 'thompson' or algo == 'all':
-        regrets['Thompson Sampling'] = simulate(Thompson_Sampling, tc.probs, tc.horizon)
-        scores['Thompson Sampling'] = 1 if regrets['Thompson Sampling'] <= tc.thompson * FACTOR else 0
+    replicas = {}
+    for key, (name, policy, num_sims, field) in TASK1_ALGOS.items():
+        if algo == key or algo == 'all':
+            scores[name], regrets[name], replicas[name] = grade(
+                partial(simulate, policy, tc.probs, tc.horizon), getattr(tc, field), num_sims)
     
-    return scores, regrets
+    return scores, regrets, replicas
+
+def grade_task1_lockstep(tc_paths, algo):
+    """grade_task1 for every testcase at once, each algorithm stepping all of
+    them together (see simulator.multi_simulate); one list entry of scores
+    and regrets per testcase
+    """
+    algo = algo.lower()
+    tcs = [read_tc(path) for path in tc_paths]
+    results = [({}, {}) for _ in tcs]
+    for key, (name, policy, num_sims, field) in TASK1_ALGOS.items():
+        if algo == key or algo == 'all':
+            regrets = multi_simulate(policy, [tc.probs for tc in tcs], [tc.horizon for tc in tcs], num_sims)
+            for (scores, regret), tc, value in zip(results, tcs, regrets):
+                regret[name] = value
+                scores[name] = 1 if value <= getattr(tc, field) * FACTOR else 0
+    return results
 
 def grade_task2(tc_path):
     tc = read_tc(tc_path)
-    regret = batch_simulate(AlgorithmBatched, tc.probs, tc.horizon, tc.batch_size)
-    score = 1 if regret <= tc.other * FACTOR else 0
-    return score, regret
+    return grade(partial(batch_simulate, AlgorithmBatched, tc.probs, tc.horizon, tc.batch_size), tc.other, 50)
 
 def grade_task3(tc_path):
     tc = read_tc(tc_path)
-    regret = simulate(AlgorithmManyArms, tc.probs, tc.horizon)
-    score = 1 if regret <= tc.other * FACTOR else 0
-    return score, regret
+    return grade(partial(simulate, AlgorithmManyArms, tc.probs, tc.horizon), tc.other, 50)
+
+def grading_jobs(algo='all'):
+    """every (testcase, algorithm) of the three tasks as a grade and every
+    replica as a job, with the arguments simulate/batch_simulate would use
+    (so results are shared with them through the cache); large instances
+    are placed in shared memory once, not pickled with every job
+    """
+    grades = []
+    jobs = []
+    def add(task, i, name, reference, func, args, num_sims, cost):
+        grade = len(grades)
+        grades.append({'task': task, 'testcase': i, 'name': name,
+            'reference': reference, 'left': num_sims, 'regrets': []})
+        for seed in replica_seeds(num_sims):
+            jobs.append((grade, func, (seed,) + args, cost))
+    for i in range(1, 4):
+        tc = read_tc(f'testcases/task1-{i}.txt')
+        for key, (name, policy, num_sims, field) in TASK1_ALGOS.items():
+            if algo != 'all' and algo != key:
+                continue
+            add(1, i, name, getattr(tc, field), single_sim, (policy, share_probs(tc.probs), tc.horizon, False, None),
+                num_sims, tc.horizon * len(tc.probs) * STEP_COST.get(policy, 1))
+        tc = read_tc(f'testcases/task2-{i}.txt')
+        add(2, i, 'Batched Algorithm', tc.other, single_batch_sim,
+            (AlgorithmBatched, share_probs(tc.probs), tc.horizon, tc.batch_size), 50,
+            tc.horizon * len(tc.probs) // tc.batch_size)
+        tc = read_tc(f'testcases/task3-{i}.txt')
+        # the many-arms policy does constant work per step
+        add(3, i, 'Many Arms Algorithm', tc.other, single_sim,
+            (AlgorithmManyArms, share_probs(tc.probs), tc.horizon, False, None), 50, tc.horizon)
+    return grades, jobs
+
+def grade_all(algo='all'):
+    """grades all testcases through one job queue on the shared pool,
+    yielding (task, testcase, scores, regrets) in task and testcase order,
+    each as soon as every replica of it and of the ones before it is done
+    """
+    grades, jobs = grading_jobs(algo)
+    waiting = {}
+    for grade in grades:
+        waiting[grade['task'], grade['testcase']] = waiting.get((grade['task'], grade['testcase']), 0) + 1
+    order = sorted(waiting)
+    done = {}
+    for g, regret in schedule_sims(jobs):
+        grade = grades[g]
+        grade['regrets'].append(regret)
+        grade['left'] -= 1
+        if grade['left']:
+            continue
+        testcase = grade['task'], grade['testcase']
+        waiting[testcase] -= 1
+        if waiting[testcase]:
+            continue
+        scores = {}
+        regrets = {}
+        for other in grades:
+            if (other['task'], other['testcase']) == testcase:
+                regrets[other['name']] = np.mean(other['regrets'])
+                scores[other['name']] = 1 if regrets[other['name']] <= other['reference'] * FACTOR else 0
+        done[testcase] = scores, regrets
+        while order and order[0] in done:
+            testcase = order.pop(0)
+            yield testcase[0], testcase[1], *done.pop(testcase)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--task', type=str, required=True, help='The task to run. Valid values are: 1, 2, 3, all')
-    parser.add_argument('--algo', type=str, required=False, help='The algo to run (for task 1 only). Valid values are: ucb, kl_ucb, thompson, all')
+    parser.add_argument('--algo', type=str, required=False, help='The algo to run (for task 1 and all). Valid values are: ucb, kl_ucb, thompson, all')
+    parser.add_argument('--lockstep', action='store_true', help='Step all task 1 testcases together (for task 1 only)')
     args = parser.parse_args()
     pass_fail = ['FAILED', 'PASSED']
+    used = lambda replicas: " ({} replicas, {:.0%} confidence)".format(replicas, CONFIDENCE) if SEQUENTIAL else ""
+
+    if args.algo is not None and args.algo.lower() not in ['ucb', 'kl_ucb', 'thompson', 'all']:
+        print('Invalid algorithm')
+        exit(1)
 
     start = time.time()
-    if args.task == '1' or args.task == 'all':
-        if args.task == 'all':
-            args.algo = 'all'
+    if args.task == 'all':
+        # one shared queue for every testcase, --algo picks the task 1 ones
+        for task, i, scores, regrets in grade_all((args.algo or 'all').lower()):
+            print(f"Task {task}, Testcase {i}", flush=True)
+            for algo, score in scores.items():
+                name = "{:18}".format(algo) if task == 1 else algo
+                print("{}: {}. Regret: {:.2f}".format(name, pass_fail[score], regrets[algo]), flush=True)
+            print("")
+
+    if args.task == '1':
         if args.algo is None:
             print('Please specify an algorithm for task 1')
             exit(1)
-        if args.algo.lower() not in ['ucb', 'kl_ucb', 'thompson', 'all']:
-            print('Invalid algorithm')
-            exit(1)
 
         print("="*18+" Task 1 "+"="*18)
+        if args.lockstep:
+            # every testcase in one run per algorithm, a fixed number of replicas
+            results = grade_task1_lockstep([f'testcases/task1-{i}.txt' for i in range(1, 4)], args.algo)
         for i in range(1, 4):
             print(f"Testcase {i}")
-            scores, regrets = grade_task1(f'testcases/task1-{i}.txt', args.algo)
+            if args.lockstep:
+                scores, regrets = results[i - 1]
+                replicas = {algo: None for algo in scores}
+            else:
+                scores, regrets, replicas = grade_task1(f'testcases/task1-{i}.txt', args.algo)
             for algo, score in scores.items():
-                print("{:18}: {}. Regret: {:.2f}".format(algo, pass_fail[score], regrets[algo]))
+                suffix = used(replicas[algo]) if replicas[algo] is not None else ""
+                print("{:18}: {}. Regret: {:.2f}{}".format(algo, pass_fail[score], regrets[algo], suffix))
             print("")
     
-    if args.task == '2' or args.task == 'all':
+    if args.task == '2':
         print("="*18+" Task 2 "+"="*18)
         for i in range(1, 4):
             print(f"Testcase {i}")
-            score, regret = grade_task2(f'testcases/task2-{i}.txt')
-            print("Batched Algorithm: {}. Regret: {:.2f}".format(pass_fail[score], regret))
+            score, regret, replicas = grade_task2(f'testcases/task2-{i}.txt')
+            print("Batched Algorithm: {}. Regret: {:.2f}{}".format(pass_fail[score], regret, used(replicas)))
             print("")
     
-    if args.task == '3' or args.task == 'all':
+    if args.task == '3':
         print("="*18+" Task 3 "+"="*18)
         for i in range(1, 4):
             print(f"Testcase {i}")
-            score, regret = grade_task3(f'testcases/task3-{i}.txt')
-            print("Many Arms Algorithm: {}. Regret: {:.2f}".format(pass_fail[score], regret))
+            score, regret, replicas = grade_task3(f'testcases/task3-{i}.txt')
+            print("Many Arms Algorithm: {}. Regret: {:.2f}{}".format(pass_fail[score], regret, used(replicas)))
             print("")
     end = time.time()
 
@@ -0,0 +1,202 @@
+import argparse, json, platform, sys, time
+import numpy as np
+from bernoulli_bandit import BernoulliBandit
+from task1 import Eps_Greedy, UCB, KL_UCB, Thompson_Sampling
+from task2 import AlgorithmBatched
+from task3 import AlgorithmManyArms
+
+POLICIES = [Eps_Greedy, UCB, KL_UCB, Thompson_Sampling]
+PERCENTILES = [50, 90, 99]
+# a result is a regression once it is this much slower than the baseline,
+# beyond the spread of the repeats
+THRESHOLD = 0.10
+# every benchmark runs WARMUP times unmeasured, then REPEATS times, keeping
+# the best of the repeats for each figure
+WARMUP = 1
+REPEATS = 5
+
+def summarize(decide, update, elapsed, steps):
+    """latency percentiles (in microseconds) and throughput of one run
+    for the bandit benchmarks the decide samples time the pull calls
+    """
+    result = {'steps': steps, 'steps_per_sec': steps / elapsed}
+    for name, samples in [('decide', decide), ('update', update)]:
+        if len(samples) == 0:
+            continue
+        for q, value in zip(PERCENTILES, np.percentile(np.array(samples) / 1e3, PERCENTILES)):
+            result['%s_p%d_us' % (name, q)] = value
+    return result
+
+def best(runs):
+    """the best of repeated runs of one benchmark: the highest throughput
+    and the lowest of each latency percentile, which are the least
+    disturbed by the rest of the machine, with the worst of each ('_worst')
+    """
+    result = dict(runs[0], repeats=len(runs))
+    for key in runs[0]:
+        values = [run[key] for run in runs]
+        if key == 'steps_per_sec':
+            result[key], result[key + '_worst'] = max(values), min(values)
+        elif key.endswith('_us'):
+            result[key], result[key + '_worst'] = min(values), max(values)
+    return result
+
+def bench_policy(algorithm, probs, horizon):
+    np.random.seed(0)
+    bandit = BernoulliBandit(probs=probs)
+    algo_inst = algorithm(num_arms=len(probs), horizon=horizon)
+    clock = time.perf_counter_ns
+    decide, update = [], []
+    start = time.perf_counter()
+    for t in range(horizon):
+        t0 = clock()
+        arm = algo_inst.give_pull()
+        t1 = clock()
+        reward = bandit.pull(arm)
+        t2 = clock()
+        algo_inst.get_reward(arm_index=arm, reward=reward)
+        t3 = clock()
+        decide.append(t1 - t0)
+        update.append(t3 - t2)
+    return summarize(decide, update, time.perf_counter() - start, horizon)
+
+def bench_batched(probs, horizon, batch_size):
+    np.random.seed(0)
+    bandit = BernoulliBandit(probs=probs, batch_size=batch_size)
+    algo_inst = AlgorithmBatched(num_arms=len(probs), horizon=horizon, batch_size=batch_size)
+    counts = algo_inst.accepts_counts
+    clock = time.perf_counter_ns
+    decide, update = [], []
+    start = time.perf_counter()
+    for t in range(horizon // batch_size):
+        t0 = clock()
+        indices, num_pulls = algo_inst.give_pull()
+        t1 = clock()
+        rewards = bandit.batch_pull(indices, num_pulls, counts)
+        t2 = clock()
+        algo_inst.get_reward(rewards)
+        t3 = clock()
+        decide.append(t1 - t0)
+        update.append(t3 - t2)
+    # throughput is counted in pulls, not rounds
+    return summarize(decide, update, time.perf_counter() - start, horizon)
+
+def bench_bandit(probs, horizon, batch_size):
+    np.random.seed(0)
+    clock = time.perf_counter_ns
+    samples = []
+    if batch_size == 1:
+        bandit = BernoulliBandit(probs=probs)
+        arms = np.random.randint(len(probs), size=horizon).tolist()
+        start = time.perf_counter()
+        for arm in arms:
+            t0 = clock()
+            bandit.pull(arm)
+            samples.append(clock() - t0)
+    else:
+        bandit = BernoulliBandit(probs=probs, batch_size=batch_size)
+        indices = np.arange(len(probs))
+        start = time.perf_counter()
+        for t in range(horizon // batch_size):
+            num_pulls = np.random.multinomial(batch_size, np.ones(len(probs)) / len(probs))
+            t0 = clock()
+            bandit.batch_pull(indices, num_pulls)
+            samples.append(clock() - t0)
+    return summarize(samples, [], time.perf_counter() - start, horizon)
+
+def cases(arms, horizons, batch_sizes):
+    """(name, bench, args) of every benchmark"""
+    for horizon in horizons:
+        for num_arms in arms:
+            probs = list(np.linspace(0, 1, num_arms, endpoint=False))
+            for algorithm in POLICIES:
+                yield '%s/arms=%d/horizon=%d' % (algorithm.__name__, num_arms, horizon), \
+                    bench_policy, (algorithm, probs, horizon)
+            yield 'pull/arms=%d/horizon=%d' % (num_arms, horizon), bench_bandit, (probs, horizon, 1)
+            for batch_size in batch_sizes:
+                if horizon % batch_size:
+                    continue
+                yield 'AlgorithmBatched/arms=%d/horizon=%d/batch=%d' % (num_arms, horizon, batch_size), \
+                    bench_batched, (probs, horizon, batch_size)
+                yield 'batch_pull/arms=%d/horizon=%d/batch=%d' % (num_arms, horizon, batch_size), \
+                    bench_bandit, (probs, horizon, batch_size)
+        # task3 instances have as many arms as the horizon
+        yield 'AlgorithmManyArms/arms=%d/horizon=%d' % (horizon, horizon), \
+            bench_policy, (AlgorithmManyArms, [i/horizon for i in range(horizon)], horizon)
+
+def run(arms, horizons, batch_sizes, warmup=WARMUP, repeats=REPEATS):
+    """best of repeats runs of every benchmark (see best), after warmup
+    unmeasured ones; the repeats go round all the benchmarks in turn, so a
+    slow spell of the machine costs each of them one repeat at most, not
+    all of one's
+    """
+    todo = list(cases(arms, horizons, batch_sizes))
+    runs = {name: [] for name, _, _ in todo}
+    for r in range(warmup + max(repeats, 1)):
+        for name, bench, args in todo:
+            result = bench(*args)
+            if r >= warmup:
+                runs[name].append(result)
+    results = {name: best(runs[name]) for name, _, _ in todo}
+    for name, result in results.items():
+        print_result(name, result)
+    return results
+
+def print_result(name, result):
+    print("{:56}: {:12.0f} steps/s  decide p50 {:8.2f} us  p99 {:8.2f} us".format(
+        name, result['steps_per_sec'], result['decide_p50_us'], result['decide_p99_us']))
+
+def compare(results, baseline, threshold):
+    """names of the results slower than the baseline by more than threshold
+    even from the worst of the baseline's repeats to the best of theirs, so
+    that only a change beyond the spread of the repeats counts (baselines
+    saved without their worst repeats are compared best to best)
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        old = baseline[name]
+        slowdown = old.get('steps_per_sec_worst', old['steps_per_sec']) / result['steps_per_sec'] - 1
+        latency = result['decide_p50_us'] / old.get('decide_p50_us_worst', old['decide_p50_us']) - 1
+        if slowdown > threshold or latency > threshold:
+            regressions.append(name)
+            print("REGRESSION {:45}: throughput {:+.1%}, decide p50 {:+.1%} (against the slowest repeats)".format(
+                name, -slowdown, latency))
+    return regressions
+
+def parse_list(text):
+    return [int(x) for x in text.split(',')]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--arms', type=parse_list, default=[2, 20, 200], help='Comma-separated arm counts')
+    parser.add_argument('--horizons', type=parse_list, default=[1000, 10000], help='Comma-separated horizons')
+    parser.add_argument('--batch-sizes', type=parse_list, default=[10, 100, 1000], help='Comma-separated batch sizes')
+    parser.add_argument('--save', type=str, required=False, help='Write the results to this JSON file')
+    parser.add_argument('--compare', type=str, required=False, help='Baseline JSON file to check for regressions')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD, help='Allowed slowdown against the baseline, beyond the spread of the repeats')
+    parser.add_argument('--warmup', type=int, default=WARMUP, help='Unmeasured runs before each benchmark')
+    parser.add_argument('--repeats', type=int, default=REPEATS, help='Measured runs of each benchmark, the best is kept')
+    args = parser.parse_args()
+
+    results = run(args.arms, args.horizons, args.batch_sizes, args.warmup, args.repeats)
+    if args.save:
+        meta = {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'time': time.strftime("%Y-%m-%d %H:%M:%S"),
+            'warmup': args.warmup,
+            'repeats': args.repeats,
+        }
+        with open(args.save, 'w') as f:
+            json.dump({'meta': meta, 'results': results}, f, indent=2)
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.threshold)
+        print("{} of {} benchmarks regressed beyond {:.0%}".format(
+            len(regressions), len(results), args.threshold))
+        if regressions:
+            sys.exit(1)
@@ -2,37 +2,147 @@
 # do not modify!
 
 import numpy as np
-import matplotlib.pyplot as plt
 
 class BernoulliArm:
-  def __init__(self, p):
+  def __init__(self, p, rng=None):
     self.p = p
+    # np.random, a np.random.Generator or a RandomTape
+    self.rng = np.random if rng is None else rng
 
   def pull(self, num_pulls=None):
-    return np.random.binomial(1, self.p, num_pulls)
+    return self.rng.binomial(1, self.p, num_pulls)
 
 class BernoulliBandit:
-  def __init__(self, probs=[0.3, 0.5, 0.7], batch_size=1):
-    self.__arms = [BernoulliArm(p) for p in probs]
+  def __init__(self, probs=[0.3, 0.5, 0.7], batch_size=1, rng=None):
+    # all arm means in one array instead of one BernoulliArm per arm; an
+    # array of floats is used as it is, not copied (the simulator passes
+    # each replica a fresh shuffled one)
+    self.__probs = np.asarray(probs, dtype=float)
+    self.__rng = np.random if rng is None else rng
     self.__batch_size = batch_size
-    self.__max_p = max(probs)
+    self.__max_p = self.__probs.max()
     self.__regret = 0
 
   def pull(self, index):
     assert self.__batch_size == 1, "\
     'pull' can't be called for in batched setting, use 'batch_pull' instead"
-    reward = self.__arms[index].pull()
+    reward = self.__rng.binomial(1, self.__probs[index], None)
     self.__regret += self.__max_p - reward
     return reward
 
-  def batch_pull(self, indices, num_pulls):
-    assert sum(num_pulls) == self.__batch_size, "\
+  def pull_many(self, index, num_pulls):
+    """pulls arm index num_pulls times in a row and returns the number of
+    successes, drawing the same values as that many calls of pull
+    """
+    assert self.__batch_size == 1, "\
+    'pull_many' can't be called for in batched setting, use 'batch_pull' instead"
+    successes = int(self.__rng.binomial(1, self.__probs[index], num_pulls).sum())
+    self.__regret += self.__max_p * num_pulls - successes
+    return successes
+
+  def batch_pull(self, indices, num_pulls, counts=False):
+    """pulls arm indices[k] num_pulls[k] times
+    returns {arm index: rewards}, or with counts=True an array holding the
+    number of successes of each arm in indices, which draws the same
+    distribution without a batch_size-length array of rewards
+    """
+    pulls = np.asarray(num_pulls)
+    total = pulls.sum()
+    assert total == self.__batch_size, "\
+    total number of pulls should match batch_size of  %d" % self.__batch_size
+    probs = self.__probs[np.asarray(indices, dtype=np.int64)]
+    if counts:
+      successes = self.__rng.binomial(pulls, probs)
+      self.__regret += self.__max_p * total - successes.sum()
+      return successes
+    # one draw for the whole batch, in the same order as pulling arm by arm
+    draws = self.__rng.binomial(1, np.repeat(probs, pulls))
+    self.__regret += self.__max_p * total - draws.sum()
+    return dict(zip(indices, np.split(draws, np.cumsum(pulls)[:-1])))
+
+  def regret(self):
+    return self.__regret
+
+  def batch_size(self):
+    return self.__batch_size
+
+  def num_arms(self):
+    return len(self.__probs)
+
+# below this many arms UniformBandit keeps the whole permutation, drawn
+# with Generator.permutation; from it on, a keyed Feistel permutation
+TABLE_ARMS = 1 << 16
+# rounds of the Feistel permutation
+ROUNDS = 8
+MASK64 = (1 << 64) - 1
+
+class UniformBandit:
+  """bandit whose arm means are a random permutation of
+  [0, 1/K, ..., (K-1)/K], as in task3; for large K computed arm by arm
+  from a keyed Feistel permutation instead of shuffling a list of K
+  probabilities
+  """
+  def __init__(self, num_arms, seed=None, batch_size=1, rng=None):
+    self.__num_arms = num_arms
+    self.__rng = np.random if rng is None else rng
+    self.__batch_size = batch_size
+    self.__max_p = (num_arms - 1) / num_arms
+    self.__regret = 0
+    if not isinstance(seed, np.random.SeedSequence):
+      seed = np.random.SeedSequence(seed)
+    # a child of a copy of seed: the replica's own stream is seeded with
+    # seed itself, and the caller's seed is not advanced by the spawn
+    child = np.random.SeedSequence(seed.entropy, spawn_key=seed.spawn_key,
+      pool_size=seed.pool_size).spawn(1)[0]
+    if num_arms < TABLE_ARMS:
+      self.__table = np.random.Generator(np.random.PCG64(child)).permutation(num_arms)
+      return
+    self.__table = None
+    # the permutation works on the smallest domain of 4^half >= num_arms
+    self.__half = max(1, ((num_arms - 1).bit_length() + 1) // 2)
+    self.__keys = [int(k) for k in child.generate_state(ROUNDS, np.uint64)]
+
+  def __permute(self, index):
+    if self.__table is not None:
+      return int(self.__table[index])
+    # python ints, numpy integers would overflow in the mixing
+    index = int(index)
+    mask = (1 << self.__half) - 1
+    while True:
+      left, right = index >> self.__half, index & mask
+      for key in self.__keys:
+        # splitmix64 finaliser of the right half and the round key
+        mix = ((right + key) * 0xBF58476D1CE4E5B9) & MASK64
+        mix = ((mix ^ (mix >> 31)) * 0x94D049BB133111EB) & MASK64
+        left, right = right, left ^ ((mix ^ (mix >> 29)) & mask)
+      index = (left << self.__half) | right
+      # cycle-walk until the value lands back inside the arms
+      if index < self.__num_arms:
+        return index
+
+  def mean(self, index):
+    return self.__permute(index) / self.__num_arms
+
+  def pull(self, index):
+    assert self.__batch_size == 1, "\
+    'pull' can't be called for in batched setting, use 'batch_pull' instead"
+    reward = self.__rng.binomial(1, self.mean(index), None)
+    self.__regret += self.__max_p - reward
+    return reward
+
+  def batch_pull(self, indices, num_pulls, counts=False):
+    pulls = np.asarray(num_pulls)
+    total = pulls.sum()
+    assert total == self.__batch_size, "\
     total number of pulls should match batch_size of  %d" % self.__batch_size
-    rewards = {}
-    for i, np in zip(indices, num_pulls):
-      rewards[i] = self.__arms[i].pull(np)
-      self.__regret += (self.__max_p * np - rewards[i].sum())
-    return rewards
+    probs = np.array([self.mean(int(i)) for i in indices])
+    if counts:
+      successes = self.__rng.binomial(pulls, probs)
+      self.__regret += self.__max_p * total - successes.sum()
+      return successes
+    draws = self.__rng.binomial(1, np.repeat(probs, pulls))
+    self.__regret += self.__max_p * total - draws.sum()
+    return dict(zip(indices, np.split(draws, np.cumsum(pulls)[:-1])))
 
   def regret(self):
     return self.__regret
@@ -41,4 +151,4 @@ class BernoulliBandit:
     return self.__batch_size
 
   def num_arms(self):
-    return len(self.__arms)
+    return self.__num_arms
@@ -0,0 +1,185 @@
+# experiment grids
+# declarative sweeps of algorithms x instances x horizons x batch sizes x
+# seeds, run as one job set on the shared pool; every finished cell is
+# appended to a checkpoint store, and a restart only runs the missing ones
+
+import argparse, hashlib, json, os, time
+import numpy as np
+import simulator
+from result_cache import describe
+from simulator import STEP_COST, replica_seeds, schedule_sims, share_probs, single_sim, single_batch_sim
+from task1 import Eps_Greedy, UCB, KL_UCB, Thompson_Sampling
+from task2 import AlgorithmBatched, Batched_UCB, Batched_KL_UCB, Batched_Thompson_Sampling
+from task3 import AlgorithmManyArms
+
+# the store is synced to disk at most this often (seconds)
+SYNC_EVERY = 1.0
+
+class Grid:
+  """the cells of a sweep, one per algorithm, instance, horizon, batch size
+  and seed; algorithms and instances map names to policies and arm means
+  a horizon of None is the instance's number of arms; AlgorithmBatched
+  policies run the batched simulation at every batch size, the others only
+  have cells of batch size 1
+  """
+  def __init__(self, name, algorithms, instances, horizons, batch_sizes=(1,), num_seeds=50, legacy=None):
+    self.name = name
+    self.algorithms = dict(algorithms)
+    self.instances = dict(instances)
+    self.horizons = list(horizons)
+    self.batch_sizes = list(batch_sizes)
+    self.num_seeds = num_seeds
+    self.legacy = legacy
+
+  def seeding(self):
+    """how the replica seeds are made, as simulator.replica_seeds would"""
+    legacy = simulator.LEGACY if self.legacy is None else self.legacy
+    return 'legacy' if legacy else 'root=%d' % simulator.ROOT_SEED
+
+  def cells(self):
+    """every cell, with the seeding and digests of its policy's source and
+    its instance's means, so a record made under other seeds, by an edited
+    policy or for other means never matches it
+    """
+    seeding = self.seeding()
+    digests = {name: instance_digest(probs) for name, probs in self.instances.items()}
+    for algorithm, policy in self.algorithms.items():
+      source = source_digest(policy)
+      for instance in self.instances:
+        for horizon in self.horizons:
+          if horizon is None:
+            horizon = len(self.instances[instance])
+          for batch_size in self.batch_sizes:
+            if horizon % batch_size or (batch_size != 1 and not is_batched(policy)):
+              continue
+            for seed in range(self.num_seeds):
+              yield {'grid': self.name, 'algorithm': algorithm, 'source': source,
+                'instance': instance, 'digest': digests[instance], 'horizon': horizon,
+                'batch_size': batch_size, 'seeding': seeding, 'seed': seed}
+
+  def job(self, cell, probs, seeds):
+    """(func, args, cost) of a cell, with the arguments simulate or
+    batch_simulate would use for that replica
+    """
+    policy = self.algorithms[cell['algorithm']]
+    horizon, batch_size = cell['horizon'], cell['batch_size']
+    arms = len(self.instances[cell['instance']])
+    seed = seeds[cell['seed']]
+    if not is_batched(policy):
+      return single_sim, (seed, policy, probs, horizon, False, None), \
+        horizon * arms * STEP_COST.get(policy, 1)
+    return single_batch_sim, (seed, policy, probs, horizon, batch_size), \
+      horizon * arms * STEP_COST.get(policy, 1) // batch_size
+
+def is_batched(policy):
+  return issubclass(getattr(policy, 'func', policy), AlgorithmBatched)
+
+def instance_digest(probs):
+  return hashlib.sha256(np.asarray(probs, dtype=float).tobytes()).hexdigest()[:16]
+
+def source_digest(policy):
+  # the policy's source as the result cache describes it
+  return hashlib.sha256(describe(policy).encode()).hexdigest()[:16]
+
+def cell_key(cell):
+  # records of earlier versions lack some fields, and match nothing
+  return '{grid}/{algorithm}/{source}/{instance}/{digest}/{horizon}/{batch_size}/{seeding}/{seed}'.format(
+    **dict({'source': None, 'digest': None, 'seeding': None}, **cell))
+
+class CheckpointStore:
+  """finished cells, one JSON record per line, appended as they finish"""
+  def __init__(self, path):
+    self.path = path
+    self.synced = time.monotonic()
+
+  def load(self):
+    """records by cell key; a line cut short by a crash is ignored"""
+    records = {}
+    if not os.path.exists(self.path):
+      return records
+    with open(self.path, 'r') as f:
+      lines = f.read().split('\n')
+    for line in lines:
+      try:
+        record = json.loads(line)
+      except ValueError:
+        continue
+      records[cell_key(record)] = record
+    if lines[-1]:
+      # end the cut line, so the next record starts on a line of its own
+      with open(self.path, 'a') as f:
+        f.write('\n')
+    return records
+
+  def append(self, record):
+    with open(self.path, 'a') as f:
+      f.write(json.dumps(record) + '\n')
+      f.flush()
+      if time.monotonic() - self.synced > SYNC_EVERY:
+        os.fsync(f.fileno())
+        self.synced = time.monotonic()
+
+def run(grid, store, verbose=True):
+  """runs every cell of grid missing from store, the most expensive first,
+  appending each result as soon as it is in; returns all records
+  """
+  records = store.load()
+  missing = [cell for cell in grid.cells() if cell_key(cell) not in records]
+  seeds = replica_seeds(grid.num_seeds, grid.legacy)
+  probs = {name: share_probs(values) for name, values in grid.instances.items()}
+  jobs = []
+  for cell in missing:
+    func, args, cost = grid.job(cell, probs[cell['instance']], seeds)
+    jobs.append((cell, func, args, cost))
+  if verbose:
+    total = sum(1 for cell in grid.cells())
+    print("{}: {} cells, {} to run".format(grid.name, total, len(missing)))
+  for count, (cell, regret) in enumerate(schedule_sims(jobs), 1):
+    record = dict(cell, regret=float(regret))
+    store.append(record)
+    records[cell_key(record)] = record
+    if verbose and count % 100 == 0:
+      print("{}: {} of {} cells run".format(grid.name, count, len(missing)))
+  return records
+
+def summarize(grid, records):
+  """mean regret and number of seeds of each (algorithm, instance,
+  horizon, batch size) with results in records
+  """
+  groups = {}
+  for cell in grid.cells():
+    record = records.get(cell_key(cell))
+    if record is not None:
+      key = (cell['algorithm'], cell['instance'], cell['horizon'], cell['batch_size'])
+      groups.setdefault(key, []).append(record['regret'])
+  return {key: (float(np.mean(regrets)), len(regrets)) for key, regrets in groups.items()}
+
+def task_grids(probs):
+  """the sweeps of simulator.task1/task2/task3 as grids"""
+  return {
+    'task1': Grid('task1', {algorithm.__name__: algorithm for algorithm in
+      [Eps_Greedy, UCB, KL_UCB, Thompson_Sampling]}, {'uniform': probs},
+      [2**i for i in range(10, 19)]),
+    'task2': Grid('task2', {algorithm.__name__: algorithm for algorithm in
+      [AlgorithmBatched, Batched_UCB, Batched_KL_UCB, Batched_Thompson_Sampling]}, {'uniform': probs},
+      [10000], [10, 20, 50, 100, 200, 500, 1000]),
+    # every horizon has its own instance of as many arms
+    'task3': Grid('task3', {'AlgorithmManyArms': AlgorithmManyArms},
+      {'arms=%d' % horizon: [i/horizon for i in range(horizon)] for horizon in
+        [1000, 5000, 10000, 15000, 20000, 30000]}, [None]),
+  }
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--grid', type=str, default='all', help='Grid to run: task1, task2, task3 or all')
+  parser.add_argument('--store', type=str, default='experiments.jsonl', help='Checkpoint store of finished cells')
+  args = parser.parse_args()
+
+  grids = task_grids([i/20 for i in range(20)])
+  store = CheckpointStore(args.store)
+  for name, grid in grids.items():
+    if args.grid not in (name, 'all'):
+      continue
+    records = run(grid, store)
+    for key, (regret, seeds) in sorted(summarize(grid, records).items(), key=str):
+      print("{:56}: {:10.2f} ({} seeds)".format('/'.join(str(k) for k in key), regret, seeds))
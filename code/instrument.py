@@ -0,0 +1,159 @@
+# Profile
+# opt-in timing of the simulator hot paths (give_pull, pull/batch_pull and
+# get_reward); simulations that do not ask for it run the plain loops
+
+import marshal, time, tracemalloc
+import numpy as np
+
+PHASES = ['give_pull', 'pull', 'get_reward']
+
+class Profile:
+  """call counts, cumulative time and sampled per-step times of each phase
+  every step is timed, but only one in sample_every is kept as a sample;
+  with allocations=True, one step in 2 sample_every others is run under
+  tracemalloc for its net allocated memory, and left out of the timings
+  """
+  def __init__(self, sample_every=64, allocations=False):
+    self.sample_every = sample_every
+    self.allocations = allocations
+    self.calls = dict.fromkeys(PHASES, 0)
+    self.total_ns = dict.fromkeys(PHASES, 0)
+    self.samples = {phase: [] for phase in PHASES}
+    self.allocated = dict.fromkeys(PHASES, 0)
+    # steps whose times are in total_ns, and steps traced for memory
+    self.timed = 0
+    self.traced = 0
+    # code locations of the timed functions, for the pstats dump
+    self.functions = {}
+    self.replicas = 0
+    self.busy_ns = 0
+    self.wall_ns = 0
+    self.workers = 1
+
+  def settings(self):
+    """what a worker needs to build an empty profile like this one"""
+    return (self.sample_every, self.allocations)
+
+  def merge(self, other):
+    for phase in PHASES:
+      self.calls[phase] += other.calls[phase]
+      self.total_ns[phase] += other.total_ns[phase]
+      self.samples[phase].extend(other.samples[phase])
+      self.allocated[phase] += other.allocated[phase]
+    self.functions.update(other.functions)
+    self.timed += other.timed
+    self.traced += other.traced
+    self.replicas += other.replicas
+    self.busy_ns += other.busy_ns
+    return self
+
+  def locate(self, phase, method):
+    code = getattr(getattr(method, '__func__', method), '__code__', None)
+    if code is not None:
+      self.functions[phase] = (code.co_filename, code.co_firstlineno, code.co_name)
+    else:
+      self.functions[phase] = ('~', 0, phase)
+
+  def run(self, algo_inst, bandit, stops, batched=False, counts=False):
+    """the simulator loop with every phase timed
+    returns the regret at each stop, as the plain loop does
+    counts=True has batch_pull return success counts (simulator.batch_counts)
+    """
+    give_pull = algo_inst.give_pull
+    if batched:
+      pull = lambda choice: bandit.batch_pull(choice[0], choice[1], counts)
+      get_reward = lambda choice, rewards: algo_inst.get_reward(rewards)
+      methods = [give_pull, bandit.batch_pull, algo_inst.get_reward]
+    else:
+      pull = bandit.pull
+      get_reward = lambda arm, reward: algo_inst.get_reward(arm_index=arm, reward=reward)
+      methods = [give_pull, bandit.pull, algo_inst.get_reward]
+    for phase, method in zip(PHASES, methods):
+      self.locate(phase, method)
+    clock = time.perf_counter_ns
+    memory = lambda: tracemalloc.get_traced_memory()[0]
+    # tracing is switched on for the traced steps only, unless someone else
+    # already traces the whole run
+    owned = not tracemalloc.is_tracing()
+    totals = [0, 0, 0]
+    regrets = []
+    steps = 0
+    begin = clock()
+    start = 0
+    for stop in stops:
+      for t in range(start, stop):
+        if self.allocations and steps % (2 * self.sample_every) == 1:
+          # traced step, its times (slowed by tracing) are not kept
+          if owned:
+            tracemalloc.start()
+          m0 = memory()
+          choice = give_pull()
+          m1 = memory()
+          rewards = pull(choice)
+          m2 = memory()
+          get_reward(choice, rewards)
+          m3 = memory()
+          if owned:
+            tracemalloc.stop()
+          for phase, grown in zip(PHASES, [m1 - m0, m2 - m1, m3 - m2]):
+            self.allocated[phase] += grown
+          self.traced += 1
+          steps += 1
+          continue
+        t0 = clock()
+        choice = give_pull()
+        t1 = clock()
+        rewards = pull(choice)
+        t2 = clock()
+        get_reward(choice, rewards)
+        t3 = clock()
+        if steps % self.sample_every == 0:
+          for phase, ns in zip(PHASES, [t1 - t0, t2 - t1, t3 - t2]):
+            self.samples[phase].append(ns)
+        totals[0] += t1 - t0
+        totals[1] += t2 - t1
+        totals[2] += t3 - t2
+        self.timed += 1
+        steps += 1
+      start = stop
+      regrets.append(bandit.regret())
+    self.busy_ns += clock() - begin
+    for phase, total in zip(PHASES, totals):
+      self.calls[phase] += steps
+      self.total_ns[phase] += total
+    self.replicas += 1
+    return regrets
+
+  def report(self):
+    """flat text report, one line per phase"""
+    lines = ["{:12} {:>10} {:>12} {:>10} {:>10} {:>10}".format(
+      'phase', 'calls', 'total (s)', 'mean (us)', 'p50 (us)', 'p99 (us)')]
+    for phase in PHASES:
+      calls = self.calls[phase]
+      samples = np.array(self.samples[phase] or [0]) / 1e3
+      lines.append("{:12} {:>10} {:>12.3f} {:>10.2f} {:>10.2f} {:>10.2f}".format(
+        phase, calls, self.total_ns[phase] / 1e9, self.total_ns[phase] / 1e3 / max(self.timed, 1),
+        np.percentile(samples, 50), np.percentile(samples, 99)))
+    overhead = self.wall_ns - self.busy_ns / max(self.workers, 1)
+    lines.append("replicas {}, busy {:.3f} s, wall {:.3f} s, pool overhead {:.3f} s".format(
+      self.replicas, self.busy_ns / 1e9, self.wall_ns / 1e9, max(overhead, 0) / 1e9))
+    if self.allocations:
+      lines.append("net bytes allocated per traced call: " + ", ".join(
+        "{} {:.1f}".format(phase, self.allocated[phase] / max(self.traced, 1)) for phase in PHASES))
+    return "\n".join(lines)
+
+  def dump_stats(self, path):
+    """writes the phases in the marshal format pstats.Stats(path) reads"""
+    root = ('~', 0, '<simulation loop>')
+    stats = {}
+    # traced steps are not timed, their share is estimated from the others
+    scale = (self.timed + self.traced) / max(self.timed, 1)
+    for phase in PHASES:
+      calls, seconds = self.calls[phase], self.total_ns[phase] * scale / 1e9
+      stats[self.functions.get(phase, ('~', 0, phase))] = (
+        calls, calls, seconds, seconds, {root: (calls, calls, seconds, seconds)})
+    loop = self.busy_ns / 1e9
+    own = loop - sum(self.total_ns.values()) * scale / 1e9
+    stats[root] = (self.replicas, self.replicas, max(own, 0), loop, {})
+    with open(path, 'wb') as f:
+      marshal.dump(stats, f)
@@ -0,0 +1,339 @@
+# lockstep simulator
+# steps all replicas of a simulation together on (num_sims, num_arms) arrays,
+# so every step costs a few NumPy calls instead of num_sims Python round-trips
+# multi_sim does the same for many instances at once: every replica of every
+# instance is a row, instances with fewer arms are padded and their missing
+# arms masked, and rows leave the arrays when their horizon is reached
+
+import math
+import numpy as np
+from task1 import Eps_Greedy, UCB, KL_UCB, Thompson_Sampling, getUCBKLIndex
+
+# number of uniforms pre-drawn per replica on each refill
+BLOCK = 4096
+
+class RewardTape:
+  """per-replica reward streams
+  replica i draws from RandomState(seeds[i]) exactly as single_sim does:
+  the instance is shuffled first and every pull then consumes one uniform,
+  which BernoulliArm.pull turns into a reward by binomial inversion
+  instances gives each replica its own arm means, padded with arms of mean
+  0 up to the widest instance
+  """
+  def __init__(self, seeds, probs=None, instances=None):
+    if instances is None:
+      instances = [probs] * len(seeds)
+    self.states = [np.random.RandomState(seed) for seed in seeds]
+    self.probs = np.zeros((len(seeds), max(len(p) for p in instances)))
+    for i, state in enumerate(self.states):
+      shuffled = list(instances[i])
+      state.shuffle(shuffled)
+      self.probs[i, :len(shuffled)] = shuffled
+    self.max_p = self.probs.max(axis=1)
+    # inversion threshold of the legacy binomial sampler for n = 1
+    low = self.probs <= 0.5
+    q = np.where(low, 1 - self.probs, 1 - (1 - self.probs))
+    with np.errstate(divide='ignore'):
+      self.thres = np.exp(np.log(q))
+    self.flip = ~low
+    self.rows = np.arange(len(seeds))
+    self.cursor = BLOCK
+    self.buffer = None
+
+  def pull(self, arms):
+    if self.cursor == BLOCK:
+      # every replica consumes exactly one uniform per step
+      self.buffer = np.stack([state.random_sample(BLOCK) for state in self.states])
+      self.cursor = 0
+    u = self.buffer[:, self.cursor]
+    self.cursor += 1
+    success = u > self.thres[self.rows, arms]
+    return (success ^ self.flip[self.rows, arms]).astype(np.int64)
+
+  def select(self, keep):
+    """keeps only the replicas at the indices keep, streams unchanged"""
+    self.states = [self.states[i] for i in keep]
+    self.probs, self.max_p = self.probs[keep], self.max_p[keep]
+    self.thres, self.flip = self.thres[keep], self.flip[keep]
+    if self.buffer is not None:
+      self.buffer = self.buffer[keep]
+    self.rows = np.arange(len(keep))
+
+MASK64 = (1 << 64) - 1
+
+def mix_int(z):
+  """mix for a single Python int, without NumPy scalar overhead"""
+  z = (z + 0x9E3779B97F4A7C15) & MASK64
+  z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+  z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & MASK64
+  return z ^ (z >> 31)
+
+def mix(z):
+  """splitmix64 finaliser, elementwise over uint64 arrays"""
+  with np.errstate(over='ignore'):
+    z = np.asarray(z, dtype=np.uint64) + np.uint64(0x9E3779B97F4A7C15)
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+  return z ^ (z >> np.uint64(31))
+
+class RowStreams:
+  """one counter-based policy stream per row, with the parts of the
+  RandomState interface the lockstep policies use
+  a number is a hash of the row's key, the call's counter, its place
+  within the call (sub) and its column, so what a row sees does not depend
+  on which other rows share the arrays, nor on how many retries their
+  rejection sampling takes
+  """
+  def __init__(self, keys):
+    self.keys = mix(np.asarray(keys, dtype=np.uint64))
+    self.counter = 0
+    # entry keys of the last (rows, width) shape drawn
+    self.entries = None
+
+  def select(self, keep):
+    self.keys = self.keys[keep]
+    self.entries = None
+
+  def uniform(self, sub=0, keys=None):
+    """uniforms in (0, 1) of the current call, one per row (or per key of
+    keys, as from entry_keys)
+    """
+    keys = self.keys if keys is None else keys
+    z = mix(keys ^ np.uint64(mix_int((self.counter << 20) | sub)))
+    return ((z >> np.uint64(11)).astype(float) + 0.5) / 2.0 ** 53
+
+  def entry_keys(self, width):
+    """keys of the entries of a (rows, width) draw, flattened"""
+    if self.entries is None or len(self.entries) != len(self.keys) * width:
+      cols = np.arange(width, dtype=np.uint64)
+      self.entries = mix(self.keys[:, None] ^ cols).ravel()
+    return self.entries
+
+  def random_sample(self, size=None):
+    self.counter += 1
+    return self.uniform()
+
+  def randint(self, high, size=None):
+    self.counter += 1
+    return (self.uniform() * high).astype(np.int64)
+
+  def gamma(self, shape):
+    """(rows, width) gamma draws by Marsaglia-Tsang, every entry retrying
+    until its own draw is accepted; the retries only touch those entries
+    """
+    self.counter += 1
+    shape = np.asarray(shape, dtype=float)
+    keys = self.entry_keys(shape.shape[1])
+    alpha = shape.ravel()
+    # shapes below 1 are boosted, gamma(a) = gamma(a + 1) U^(1 / a)
+    d = np.where(alpha < 1, alpha + 1, alpha) - 1 / 3
+    c = 1 / np.sqrt(9 * d)
+    result = np.empty(len(alpha))
+    pending = np.arange(len(alpha))
+    retry = 0
+    while len(pending):
+      k, dk, ck = keys[pending], d[pending], c[pending]
+      # Box-Muller normal and the acceptance uniform of this retry
+      x = np.sqrt(-2 * np.log(self.uniform(3 * retry + 1, k))) \
+        * np.cos(2 * math.pi * self.uniform(3 * retry + 2, k))
+      u = self.uniform(3 * retry + 3, k)
+      v = (1 + ck * x) ** 3
+      with np.errstate(invalid='ignore', divide='ignore'):
+        accept = (v > 0) & (np.log(u) < 0.5 * x * x + dk - dk * v + dk * np.log(v))
+      result[pending[accept]] = (dk * v)[accept]
+      pending = pending[~accept]
+      retry += 1
+    small = alpha < 1
+    if small.any():
+      result[small] *= self.uniform(0, keys[small]) ** (1 / alpha[small])
+    return result.reshape(shape.shape)
+
+  def beta(self, a, b):
+    """beta draws of shape (rows, arms), from a pair of gamma draws"""
+    x = self.gamma(a)
+    y = self.gamma(b)
+    return x / (x + y)
+
+class LockstepAlgorithm:
+  """policy state of num_sims replicas, one row each
+  arms gives each row its own number of arms, the first arms[i] of the
+  num_arms columns; the others are never pulled
+  """
+  def __init__(self, num_sims, num_arms, horizon, rng, arms=None):
+    self.num_sims = num_sims
+    self.num_arms = num_arms
+    self.horizon = horizon
+    self.rng = rng
+    self.rows = np.arange(num_sims)
+    self.arms = None if arms is None else np.asarray(arms)
+    self.mask = None if arms is None else np.arange(num_arms) < self.arms[:, None]
+
+  def best(self, index):
+    """the arm of largest index in every row, among its real arms"""
+    if self.mask is not None:
+      index = np.where(self.mask, index, -np.inf)
+    return np.argmax(index, axis=1)
+
+  def select(self, keep):
+    """keeps only the rows at the indices keep"""
+    for name, value in vars(self).items():
+      if isinstance(value, np.ndarray) and name != 'rows' and len(value) == self.num_sims:
+        setattr(self, name, value[keep])
+    self.num_sims = len(keep)
+    self.rows = np.arange(self.num_sims)
+    if hasattr(self.rng, 'select'):
+      self.rng.select(keep)
+
+  def give_pull(self):
+    raise NotImplementedError
+
+  def get_reward(self, arm_indices, rewards):
+    raise NotImplementedError
+
+class LockstepEpsGreedy(LockstepAlgorithm):
+  def __init__(self, num_sims, num_arms, horizon, rng, arms=None):
+    super().__init__(num_sims, num_arms, horizon, rng, arms)
+    self.eps = 0.1
+    self.counts = np.zeros((num_sims, num_arms))
+    self.values = np.zeros((num_sims, num_arms))
+
+  def give_pull(self):
+    explore = self.rng.random_sample(self.num_sims) < self.eps
+    if self.arms is None:
+      random_arms = self.rng.randint(self.num_arms, size=self.num_sims)
+    else:
+      random_arms = (self.rng.random_sample(self.num_sims) * self.arms).astype(np.int64)
+    return np.where(explore, random_arms, self.best(self.values))
+
+  def get_reward(self, arm_indices, rewards):
+    self.counts[self.rows, arm_indices] += 1
+    n = self.counts[self.rows, arm_indices]
+    value = self.values[self.rows, arm_indices]
+    self.values[self.rows, arm_indices] = ((n - 1) / n) * value + (1 / n) * rewards
+
+class LockstepUCB(LockstepAlgorithm):
+  def __init__(self, num_sims, num_arms, horizon, rng, arms=None):
+    super().__init__(num_sims, num_arms, horizon, rng, arms)
+    self.num_pulls = 0
+    self.pulls = np.zeros((num_sims, num_arms))
+    self.rewards = np.zeros((num_sims, num_arms))
+
+  def give_pull(self):
+    self.num_pulls += 1
+    num = math.sqrt(2 * math.log(self.num_pulls))
+    with np.errstate(divide='ignore', invalid='ignore'):
+      ucb = self.rewards / self.pulls + num / np.sqrt(self.pulls)
+    # same placeholder index as getEmpMean + getUCBUncert for unpulled arms
+    ucb[self.pulls == 0] = 2e5
+    return self.best(ucb)
+
+  def get_reward(self, arm_indices, rewards):
+    self.pulls[self.rows, arm_indices] += 1
+    self.rewards[self.rows, arm_indices] += rewards
+
+class LockstepKLUCB(LockstepUCB):
+  def __init__(self, num_sims, num_arms, horizon, rng, arms=None):
+    super().__init__(num_sims, num_arms, horizon, rng, arms)
+    self.c = 3
+    self.tol = 1e-3
+
+  def give_pull(self):
+    self.num_pulls += 1
+    with np.errstate(divide='ignore', invalid='ignore'):
+      empMean = np.where(self.pulls == 0, 1e5, self.rewards / self.pulls)
+    ucbkl = getUCBKLIndex(self.num_pulls, self.c, empMean, self.pulls, self.tol)
+    return self.best(ucbkl)
+
+class LockstepThompson(LockstepUCB):
+  def give_pull(self):
+    thmpsn = self.rng.beta(self.rewards + 1, self.pulls - self.rewards + 1)
+    return self.best(thmpsn)
+
+# policies that have a lockstep counterpart
+LOCKSTEP = {
+  Eps_Greedy: LockstepEpsGreedy,
+  UCB: LockstepUCB,
+  KL_UCB: LockstepKLUCB,
+  Thompson_Sampling: LockstepThompson,
+}
+
+def lockstep_sim(algorithm, probs, horizon, num_sims=50, seed=0, checkpoints=None):
+  """simulates num_sims replicas of algorithm at once
+  returns the per-replica regrets; for the deterministic policies (UCB,
+  KL_UCB) replica i reproduces single_sim(i, algorithm, list(probs), horizon),
+  for the randomised ones the policy draws come from one shared stream
+  seeded by seed, so they match simulate() in distribution only
+  with checkpoints, returns a (num_sims, len(checkpoints)) array of the
+  regrets at each of them instead
+  """
+  if algorithm not in LOCKSTEP:
+    raise ValueError("no lockstep engine for %s" % algorithm.__name__)
+  tape = RewardTape(range(num_sims), probs)
+  algo_inst = LOCKSTEP[algorithm](num_sims, len(probs), horizon,
+    np.random.RandomState(seed))
+  regrets = np.zeros(num_sims)
+  stops = [horizon] if checkpoints is None else sorted(checkpoints)
+  recorded = []
+  start = 0
+  for stop in stops:
+    for t in range(start, stop):
+      arms_to_be_pulled = algo_inst.give_pull()
+      rewards = tape.pull(arms_to_be_pulled)
+      regrets += tape.max_p - rewards
+      algo_inst.get_reward(arms_to_be_pulled, rewards)
+    start = stop
+    recorded.append(regrets.copy())
+  return recorded[0] if checkpoints is None else np.stack(recorded, axis=1)
+
+def multi_sim(algorithm, instances, horizons, num_sims=50, seed=0, ids=None):
+  """simulates num_sims replicas of algorithm on every instance (a list of
+  arm means each, of any lengths) at once, with horizons one per instance
+  or one for all; returns the (len(instances), num_sims) regrets
+  replica i of every instance reproduces lockstep_sim(algorithm, instance,
+  horizon, num_sims) for UCB and KL_UCB, and matches it in distribution for
+  the randomised policies, whose draws come from a RowStreams stream of
+  its own per replica, keyed by seed, the instance's id (its index unless
+  ids says otherwise) and i; so the regrets of an instance do not depend
+  on the other instances run with it
+  """
+  if algorithm not in LOCKSTEP:
+    raise ValueError("no lockstep engine for %s" % algorithm.__name__)
+  if np.ndim(horizons) == 0:
+    horizons = [horizons] * len(instances)
+  # row j * num_sims + i is replica i of instance j
+  rows = [(j, i) for j in range(len(instances)) for i in range(num_sims)]
+  tape = RewardTape([i for _, i in rows], instances=[instances[j] for j, _ in rows])
+  arms = np.array([len(instances[j]) for j, _ in rows])
+  end = np.array([horizons[j] for j, _ in rows])
+  ids = range(len(instances)) if ids is None else ids
+  streams = RowStreams([mix(mix(seed) ^ np.uint64(ids[j])) ^ np.uint64(i) for j, i in rows])
+  algo_inst = LOCKSTEP[algorithm](len(rows), arms.max(), end.max(), streams, arms=arms)
+  # rows still running, as indices into rows
+  active = np.arange(len(rows))
+  regrets = np.zeros(len(rows))
+  start = 0
+  for stop in sorted(set(end)):
+    running = np.zeros(len(active))
+    for t in range(start, stop):
+      arms_to_be_pulled = algo_inst.give_pull()
+      rewards = tape.pull(arms_to_be_pulled)
+      running += tape.max_p - rewards
+      algo_inst.get_reward(arms_to_be_pulled, rewards)
+    regrets[active] += running
+    start = stop
+    # rows whose horizon is reached drop out of every array
+    keep = np.flatnonzero(end[active] > stop)
+    active = active[keep]
+    if len(active) == 0:
+      break
+    tape.select(keep)
+    algo_inst.select(keep)
+  return regrets.reshape(len(instances), num_sims)
+
+def instance_family(num_instances, arms, seed=0):
+  """num_instances bandit instances with arm means drawn uniformly from
+  [0, 1), their numbers of arms drawn from arms (a number or a list)
+  """
+  rng = np.random.default_rng(seed)
+  counts = rng.choice(np.atleast_1d(arms), size=num_instances)
+  return [list(rng.random(count)) for count in counts]
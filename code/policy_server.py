@@ -0,0 +1,157 @@
+# PolicyServer
+# serves give_pull/get_reward of one policy to many concurrent asyncio
+# callers: requests wait up to a batching window, then the rewards that came
+# in are applied in bulk and the waiting pulls are decided together
+
+import argparse, asyncio, time
+import numpy as np
+from bernoulli_bandit import BernoulliBandit
+from task1 import Eps_Greedy, UCB, KL_UCB, Thompson_Sampling
+
+POLICIES = {cls.__name__: cls for cls in [Eps_Greedy, UCB, KL_UCB, Thompson_Sampling]}
+
+class PolicyServer:
+  """wraps a policy (any task1 Algorithm) for concurrent use
+  the policy is only touched by the serving task, so it needs no locking;
+  pulls decided in one micro-batch see the same feedback, as the batched
+  policies of task2 do, so a longer window trades regret and latency for
+  fewer, larger batches
+  """
+  def __init__(self, algo_inst, window=0.0, max_batch=256):
+    self.algo_inst = algo_inst
+    self.window = window
+    self.max_batch = max_batch
+    # waiting pulls (future, arrival time) and rewards (arm, reward)
+    self.pulls = []
+    self.rewards = []
+    self.wakeup = None
+    self.task = None
+    self.running = False
+    # metrics
+    self.latencies = []
+    self.depths = []
+    self.batches = 0
+    self.decisions = 0
+    self.updates = 0
+
+  async def start(self):
+    self.wakeup = asyncio.Event()
+    self.running = True
+    self.task = asyncio.create_task(self.serve())
+
+  async def stop(self):
+    self.running = False
+    self.wakeup.set()
+    await self.task
+
+  async def pull(self):
+    """the arm to pull next"""
+    future = asyncio.get_running_loop().create_future()
+    self.pulls.append((future, time.perf_counter()))
+    self.wakeup.set()
+    return await future
+
+  def reward(self, arm_index, reward):
+    """queues the reward of a pull, applied with the next micro-batch"""
+    self.rewards.append((arm_index, reward))
+    self.wakeup.set()
+
+  async def serve(self):
+    while self.running or self.pulls or self.rewards:
+      await self.wakeup.wait()
+      self.wakeup.clear()
+      if self.window and len(self.pulls) < self.max_batch:
+        # let more requests join this batch
+        await asyncio.sleep(self.window)
+      self.depths.append(len(self.pulls) + len(self.rewards))
+      rewards, self.rewards = self.rewards, []
+      pulls, self.pulls = self.pulls[:self.max_batch], self.pulls[self.max_batch:]
+      if self.pulls:
+        self.wakeup.set()
+      self.apply(rewards)
+      now = time.perf_counter()
+      for future, arrival in pulls:
+        future.set_result(self.algo_inst.give_pull())
+        self.latencies.append(now - arrival)
+      self.batches += 1
+      self.decisions += len(pulls)
+      # give the callers a turn before the next batch
+      await asyncio.sleep(0)
+
+  def apply(self, rewards):
+    """applies the rewards in bulk, as one run per arm where the policy
+    supports it (get_rewards), one by one otherwise
+    """
+    if not rewards:
+      return
+    self.updates += len(rewards)
+    if not hasattr(self.algo_inst, 'get_rewards'):
+      for arm_index, reward in rewards:
+        self.algo_inst.get_reward(arm_index=arm_index, reward=reward)
+      return
+    arms, values = np.array(rewards).T
+    arms = arms.astype(np.int64)
+    counts = np.bincount(arms)
+    successes = np.bincount(arms, values)
+    for arm_index in np.flatnonzero(counts):
+      self.algo_inst.get_rewards(arm_index, int(counts[arm_index]), successes[arm_index])
+
+  def metrics(self):
+    """latency percentiles (in microseconds), queue depth and batching"""
+    latencies = np.array(self.latencies or [0]) * 1e6
+    return {
+      'decisions': self.decisions,
+      'updates': self.updates,
+      'batches': self.batches,
+      'mean_batch': self.decisions / max(self.batches, 1),
+      'mean_depth': float(np.mean(self.depths or [0])),
+      'max_depth': int(np.max(self.depths or [0])),
+      'latency_p50_us': float(np.percentile(latencies, 50)),
+      'latency_p99_us': float(np.percentile(latencies, 99)),
+    }
+
+async def client(server, bandit, decisions):
+  """one request handler: pull, act on the stand-in environment, report"""
+  for _ in range(decisions):
+    arm_index = await server.pull()
+    server.reward(arm_index, bandit.pull(arm_index))
+
+async def run_load(algorithm, probs, concurrency, decisions, window, seed=0):
+  """drives a server with concurrency clients sharing decisions pulls of a
+  BernoulliBandit; returns the server metrics with throughput and regret
+  """
+  rng = np.random.default_rng(seed)
+  bandit = BernoulliBandit(probs=probs, rng=rng)
+  server = PolicyServer(algorithm(num_arms=len(probs), horizon=decisions, rng=rng), window)
+  await server.start()
+  start = time.perf_counter()
+  # the first decisions % concurrency clients make one pull more
+  shares = [decisions // concurrency + (c < decisions % concurrency) for c in range(concurrency)]
+  await asyncio.gather(*[client(server, bandit, share) for share in shares])
+  elapsed = time.perf_counter() - start
+  await server.stop()
+  result = server.metrics()
+  result['decisions_per_sec'] = result['decisions'] / elapsed
+  result['regret'] = float(bandit.regret())
+  return result
+
+def parse_list(text, kind=int):
+  return [kind(x) for x in text.split(',')]
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--policy', type=str, default='UCB', help='One of ' + ', '.join(POLICIES))
+  parser.add_argument('--arms', type=int, default=20, help='Number of arms of the stand-in bandit')
+  parser.add_argument('--decisions', type=int, default=20000, help='Total pulls served per run')
+  parser.add_argument('--concurrency', type=parse_list, default=[1, 4, 16, 64, 256], help='Comma-separated client counts')
+  parser.add_argument('--windows', type=lambda text: parse_list(text, float), default=[0.0, 0.001], help='Comma-separated batching windows (seconds)')
+  args = parser.parse_args()
+
+  probs = list(np.linspace(0, 1, args.arms, endpoint=False))
+  for window in args.windows:
+    for concurrency in args.concurrency:
+      result = asyncio.run(run_load(POLICIES[args.policy], probs, concurrency, args.decisions, window))
+      print("window {:6.4f} s, {:4} clients: {:10.0f} decisions/s  batch {:6.1f}  depth {:6.1f}  "
+        "p50 {:8.1f} us  p99 {:9.1f} us  regret {:8.1f}".format(window, concurrency,
+        result['decisions_per_sec'], result['mean_batch'], result['mean_depth'],
+        result['latency_p50_us'], result['latency_p99_us'], result['regret']))
@@ -0,0 +1,103 @@
+# report
+# renders the task plots from stored results, headless and on demand; the
+# only module that imports matplotlib, so simulations never pay for it
+
+import argparse, json, os
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+from trajectory import mean_trajectory
+
+def plot_trajectories(curves, title, filename):
+  """plots the mean regret-vs-time curve of each (label, path, stride)"""
+  for label, path, stride in curves:
+    mean = mean_trajectory(path)
+    plt.plot(np.arange(1, len(mean) + 1) * stride, mean, label=label)
+  if len(curves) > 1:
+    plt.legend()
+  plt.title(title)
+  plt.savefig(filename)
+  plt.clf()
+
+def render(path):
+  """renders a result saved by simulator.task1/task2/task3 next to it, as
+  <name>-<time>.png (and <name>-curve-<time>.png with trajectories)
+  """
+  with open(path, 'r') as f:
+    result = json.load(f)
+  folder = os.path.dirname(path)
+  name, stamp = result['name'], result['time']
+  if 'curves' in result:
+    plot_trajectories(result['curves'], "Regret vs Time",
+      os.path.join(folder, "{}-curve-{}.png".format(name, stamp)))
+  if 'bands' in result:
+    bands = result['bands']
+    plt.fill_between(result['x'], bands['p05'], bands['p95'], alpha=0.3)
+    plt.plot(result['x'], bands['median'], linestyle='--')
+  if 'series' in result:
+    # several policies against the same x
+    for label, regrets in result['series'].items():
+      plt.plot(result['x'], regrets, label=label)
+    plt.legend()
+  else:
+    plt.plot(result['x'], result['regret'])
+  plt.title(result['title'])
+  filename = os.path.join(folder, "{}-{}.png".format(name, stamp))
+  plt.savefig(filename)
+  plt.clf()
+  return filename
+
+def render_store(path, folder='.'):
+  """renders <grid>-<algorithm>.png with the mean regret over seeds of an
+  experiments.py checkpoint store, against batch size when the grid
+  varies it and against horizon otherwise; batch size sweeps also get a
+  <grid>.png with every algorithm of the grid together
+  """
+  groups = {}
+  with open(path, 'r') as f:
+    for line in f:
+      try:
+        record = json.loads(line)
+      except ValueError:
+        continue
+      groups.setdefault((record['grid'], record['algorithm']), []).append(record)
+  filenames = []
+  tradeoffs = {}
+  for (grid, algorithm), records in sorted(groups.items()):
+    axis = 'batch_size' if len({r['batch_size'] for r in records}) > 1 else 'horizon'
+    regrets = {}
+    for record in records:
+      regrets.setdefault(record[axis], []).append(record['regret'])
+    x = sorted(regrets)
+    plt.plot(x, [np.mean(regrets[value]) for value in x])
+    plt.title("Regret vs {}".format('Batch Size' if axis == 'batch_size' else 'Horizon'))
+    filenames.append(os.path.join(folder, "{}-{}.png".format(grid, algorithm)))
+    plt.savefig(filenames[-1])
+    plt.clf()
+    if axis == 'batch_size':
+      tradeoffs.setdefault(grid, []).append((algorithm, x, [np.mean(regrets[value]) for value in x]))
+  for grid, series in sorted(tradeoffs.items()):
+    if len(series) < 2:
+      continue
+    for algorithm, x, mean in series:
+      plt.plot(x, mean, label=algorithm)
+    plt.xscale('log')
+    plt.legend()
+    plt.title("Regret vs Batch Size")
+    filenames.append(os.path.join(folder, "{}.png".format(grid)))
+    plt.savefig(filenames[-1])
+    plt.clf()
+  return filenames
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument('results', nargs='*', help='Result files saved by simulator.task1/task2/task3')
+  parser.add_argument('--store', type=str, required=False, help='Checkpoint store of experiments.py to plot')
+  args = parser.parse_args()
+
+  for path in args.results:
+    print(render(path))
+  if args.store:
+    for filename in render_store(args.store):
+      print(filename)
@@ -0,0 +1,108 @@
+# ResultCache
+# on-disk cache of per-replica simulation results, keyed by a hash of
+# everything that produced them
+
+import hashlib, inspect, os, tempfile
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# BANDIT_CACHE=0 turns the cache off, any other value is its directory
+CACHE_DIR = os.environ.get('BANDIT_CACHE', os.path.join(HERE, '.cache'))
+# the least recently used entries are dropped beyond this size
+MAX_BYTES = 256 << 20
+# editing any of these invalidates every entry
+SOURCES = ['bernoulli_bandit.py', 'simulator.py', 'lockstep.py', 'rng_tape.py',
+  'task1.py', 'task2.py', 'task3.py']
+
+# source text of classes and functions already looked up
+_sources = {}
+
+def describe(obj):
+  """stable text for one argument of a simulation"""
+  if inspect.isclass(obj) or inspect.isfunction(obj):
+    if obj not in _sources:
+      try:
+        source = ''.join(inspect.getsource(cls) for cls in getattr(obj, '__mro__', [obj])
+          if cls is not object)
+      except (OSError, TypeError):
+        # no source to hash, so results are only reused in this process
+        source = 'unhashable-%s' % os.urandom(8).hex()
+      _sources[obj] = '%s.%s:%s' % (obj.__module__, obj.__qualname__, source)
+    return _sources[obj]
+  if hasattr(obj, 'func') and hasattr(obj, 'keywords'):
+    # functools.partial of a policy
+    return 'partial(%s, %s, %s)' % (describe(obj.func),
+      [describe(a) for a in obj.args], sorted(obj.keywords.items()))
+  if isinstance(obj, np.ndarray):
+    return 'array(%s)' % obj.tolist()
+  return repr(obj)
+
+class ResultCache:
+  def __init__(self, path=CACHE_DIR, max_bytes=MAX_BYTES):
+    self.path = path
+    self.max_bytes = max_bytes
+    os.makedirs(path, exist_ok=True)
+    digest = hashlib.sha256()
+    for name in SOURCES:
+      with open(os.path.join(HERE, name), 'rb') as f:
+        digest.update(f.read())
+    self.sources = digest.hexdigest()
+
+  def key(self, func, args):
+    """hash of the simulation function, its arguments and the sources"""
+    digest = hashlib.sha256(self.sources.encode())
+    digest.update(describe(func).encode())
+    for arg in args:
+      digest.update(b'\0' + describe(arg).encode())
+    return digest.hexdigest()
+
+  def __file(self, key):
+    return os.path.join(self.path, key + '.npy')
+
+  def get(self, key):
+    """cached result, or None; a hit marks the entry as recently used"""
+    path = self.__file(key)
+    try:
+      value = np.load(path)
+      os.utime(path)
+    except (OSError, ValueError):
+      return None
+    return value.item() if value.ndim == 0 else value
+
+  def put(self, key, value):
+    # write to a temporary file first, readers never see half an entry
+    fd, tmp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+      np.save(f, np.asarray(value))
+    os.replace(tmp, self.__file(key))
+
+  def trim(self):
+    """drops least recently used entries until the cache fits max_bytes"""
+    entries = []
+    for entry in os.scandir(self.path):
+      if entry.name.endswith('.npy'):
+        stat = entry.stat()
+        entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+      if total <= self.max_bytes:
+        break
+      try:
+        os.remove(path)
+      except OSError:
+        pass
+      total -= size
+
+  def clear(self):
+    for entry in os.scandir(self.path):
+      if entry.name.endswith('.npy'):
+        os.remove(entry.path)
+
+_cache = None
+
+def get_cache():
+  """the shared cache, or None when BANDIT_CACHE=0"""
+  global _cache
+  if _cache is None and CACHE_DIR != '0':
+    _cache = ResultCache()
+  return _cache
@@ -0,0 +1,86 @@
+# RandomTape
+# buffered random numbers for the bandit and the policies
+
+import numpy as np
+
+# number of values pre-drawn on each refill
+BLOCK = 1 << 16
+
+class RandomTape:
+  """serves random numbers from pre-drawn blocks through a cursor
+  uniforms come from one stream and beta variates from another, so a seed
+  reproduces the same values whatever the block size; the method names
+  follow np.random, so a tape can be passed wherever np.random is used
+  """
+  def __init__(self, seed=None, block_size=BLOCK):
+    # seed may also be a SeedSequence, such as a replica's spawned one
+    if not isinstance(seed, np.random.SeedSequence):
+      seed = np.random.SeedSequence(seed)
+    # children of a copy, so the caller's seed is not advanced and every
+    # tape made from it replays the same values
+    uniform, beta = np.random.SeedSequence(seed.entropy, spawn_key=seed.spawn_key,
+      pool_size=seed.pool_size).spawn(2)
+    self.block_size = block_size
+    self.__uniform = np.random.Generator(np.random.PCG64(uniform))
+    self.__beta = np.random.Generator(np.random.PCG64(beta))
+    self.__block = np.empty(0)
+    # python copy of the block, scalar draws are much cheaper from a list
+    self.__values = []
+    self.__cursor = 0
+
+  def __refill(self, n):
+    rest = self.__block[self.__cursor:]
+    fresh = self.__uniform.random(max(self.block_size, n))
+    self.__block = np.concatenate((rest, fresh))
+    self.__values = self.__block.tolist()
+    self.__cursor = 0
+
+  def __take(self, n):
+    if self.__cursor + n > len(self.__block):
+      self.__refill(n)
+    start = self.__cursor
+    self.__cursor += n
+    return self.__block[start:self.__cursor]
+
+  def random(self, size=None):
+    if size is None:
+      if self.__cursor == len(self.__values):
+        self.__refill(1)
+      self.__cursor += 1
+      return self.__values[self.__cursor - 1]
+    return self.__take(int(np.prod(size))).reshape(size)
+
+  def randint(self, high, size=None):
+    if size is None:
+      return int(self.random() * high)
+    return (self.random(size) * high).astype(np.int64)
+
+  def binomial(self, n, p, size=None):
+    if size is None and isinstance(p, float):
+      if n == 1:
+        # one Bernoulli outcome straight off the tape
+        if self.__cursor == len(self.__values):
+          self.__refill(1)
+        self.__cursor += 1
+        return int(self.__values[self.__cursor - 1] < p)
+      return int((self.random(n) < p).sum())
+    if np.ndim(n) > 0:
+      # a different number of trials for each p, counted per entry
+      n = np.asarray(n)
+      hits = self.random(n.sum()) < np.repeat(p, n)
+      return np.bincount(np.repeat(np.arange(len(n)), n), hits, len(n)).astype(np.int64)
+    shape = np.shape(p) if size is None else np.atleast_1d(size)
+    u = self.random(tuple(shape) + (n,))
+    return (u < np.expand_dims(p, -1)).sum(axis=-1)
+
+  def geometric(self, p, size=None):
+    # trials up to the first success, by inversion of a tape uniform
+    u = self.random(size)
+    with np.errstate(divide='ignore'):
+      k = np.floor(np.log1p(-u) / np.log1p(-np.asarray(p, dtype=float))) + 1
+    k = np.where(np.asarray(p) >= 1, 1, np.maximum(k, 1))
+    return int(k) if size is None and np.ndim(p) == 0 else k.astype(np.int64)
+
+  def beta(self, a, b, size=None):
+    # the shape parameters change on every call, so these are not buffered
+    return self.__beta.beta(a, b, size)
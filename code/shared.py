@@ -0,0 +1,108 @@
+# SharedArray
+# instance data (arm means and the like) placed once in shared memory, so
+# that pool workers map it instead of unpickling a copy with every task
+
+import atexit, hashlib, os
+from collections import OrderedDict
+from multiprocessing import resource_tracker, shared_memory
+import numpy as np
+
+# blocks kept alive by the parent, and mappings kept open by each worker
+MAX_BLOCKS = 16
+
+# blocks created by this process, by content digest, and their views by name
+_blocks = OrderedDict()
+_views = {}
+# blocks this process has mapped, by name
+_attached = OrderedDict()
+# forked workers inherit _blocks, but only the creator frees them
+_owner = os.getpid()
+
+class SharedArray:
+  """picklable handle of an array in shared memory, only the name, shape
+  and dtype travel with it; array() maps it as a read-only view
+  """
+  def __init__(self, name, shape, dtype, digest):
+    self.name = name
+    self.shape = shape
+    self.dtype = dtype
+    self.digest = digest
+
+  def __len__(self):
+    return self.shape[0]
+
+  def __repr__(self):
+    # the contents, not the block name, identify it (for result_cache)
+    return 'SharedArray(%s, %s, %s)' % (self.shape, self.dtype, self.digest)
+
+  def array(self):
+    if self.name in _views:
+      view = _views[self.name]
+    elif self.name in _attached:
+      _attached.move_to_end(self.name)
+      view = _attached[self.name][1]
+    else:
+      # workers share the creator's resource tracker (see start_tracker),
+      # which the attach registers with again, harmlessly; unregistering
+      # here would drop the creator's own registration
+      shm = shared_memory.SharedMemory(name=self.name)
+      view = np.ndarray(self.shape, self.dtype, buffer=shm.buf)
+      view.flags.writeable = False
+      _attached[self.name] = (shm, view)
+      while len(_attached) > MAX_BLOCKS:
+        _, (old, _) = _attached.popitem(last=False)
+        _close(old)
+    return view
+
+def start_tracker():
+  """starts this process's resource tracker before workers are started,
+  so that they all use it instead of starting one of their own (a forked
+  worker would otherwise, and its tracker would unlink blocks it maps)
+  """
+  resource_tracker.ensure_running()
+
+def _close(shm):
+  try:
+    shm.close()
+  except BufferError:
+    # a view is still in use, the mapping goes when it does
+    pass
+
+def share(values):
+  """handle of a shared copy of values, reusing a block with the same
+  contents if this process already made one
+  """
+  values = np.ascontiguousarray(values)
+  digest = hashlib.sha256(values.tobytes()).hexdigest()
+  if digest in _blocks:
+    _blocks.move_to_end(digest)
+    return _blocks[digest][0]
+  shm = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+  view = np.ndarray(values.shape, values.dtype, buffer=shm.buf)
+  view[...] = values
+  view.flags.writeable = False
+  handle = SharedArray(shm.name, values.shape, values.dtype.str, digest)
+  _blocks[digest] = (handle, shm)
+  _views[handle.name] = view
+  while len(_blocks) > MAX_BLOCKS:
+    _free(*_blocks.popitem(last=False)[1])
+  return handle
+
+def _free(handle, shm):
+  del _views[handle.name]
+  _close(shm)
+  if os.getpid() == _owner:
+    shm.unlink()
+
+def as_array(values):
+  """values as a float array, mapping a SharedArray handle"""
+  if isinstance(values, SharedArray):
+    return values.array()
+  return np.asarray(values, dtype=float)
+
+def release():
+  """frees every block this process created"""
+  while _blocks:
+    _free(*_blocks.popitem()[1])
+
+atexit.register(release)
@@ -3,103 +3,648 @@
 
 from bernoulli_bandit import *
 from task1 import Algorithm, Eps_Greedy, UCB, KL_UCB, Thompson_Sampling
-from task2 import AlgorithmBatched
+from task2 import AlgorithmBatched, Batched_UCB, Batched_KL_UCB, Batched_Thompson_Sampling
 from task3 import AlgorithmManyArms
+from lockstep import LOCKSTEP, lockstep_sim, multi_sim
+from rng_tape import RandomTape
+from result_cache import get_cache
+from instrument import Profile
+from trajectory import TrajectoryWriter, create_trajectories
+from aggregate import RegretAggregate, SequentialTest
+from shared import as_array, share, start_tracker
 from multiprocessing import Pool
-import time
+from functools import partial
+import ast, atexit, inspect, json, math, os, textwrap, time
+import numpy as np
 
-def single_sim(seed=0, ALGO=Algorithm, PROBS=[0.3, 0.5, 0.7], HORIZON=1000):
+# worker processes shared by every simulate/batch_simulate call: None sizes
+# the pool from the available cores, 0 runs all replicas in this process
+WORKERS = int(os.environ['BANDIT_WORKERS']) if 'BANDIT_WORKERS' in os.environ else None
+# replicas are grouped into tasks of at least this many arm-steps of work
+TASK_COST = 10**6
+# reuse per-replica results from the on-disk cache (see result_cache.py)
+CACHE = True
+# instances with at least this many arms reach the workers through shared
+# memory (see shared.py), smaller ones are cheaper to pickle
+SHARE_ARMS = 1024
+# replica i draws from its own Generator, seeded by the i-th child of
+# SeedSequence(ROOT_SEED); LEGACY=True seeds the global np.random state with
+# i instead, reproducing the numbers of earlier versions
+ROOT_SEED = 0
+LEGACY = False
+# relative cost of a step per arm, for scheduling; KL-UCB bisects for every
+# arm's index
+STEP_COST = {KL_UCB: 20, Batched_KL_UCB: 20}
+
+_pool = None
+
+def num_workers():
+  """number of worker processes the shared pool uses"""
+  if WORKERS is not None:
+    return WORKERS
+  try:
+    return len(os.sched_getaffinity(0))
+  except AttributeError:
+    return os.cpu_count() or 1
+
+def close_pool():
+  """shuts the shared pool down, the next call starts a fresh one"""
+  global _pool
+  if _pool is not None:
+    _pool.close()
+    _pool.join()
+    _pool = None
+
+def set_workers(workers=None):
+  """sets the size of the shared pool (None for all cores, 0 for serial)"""
+  global WORKERS
+  close_pool()
+  WORKERS = workers
+
+def get_pool():
+  """returns the shared pool, starting it on first use"""
+  global _pool
+  if _pool is None:
+    start_tracker()
+    _pool = Pool(num_workers())
+    atexit.register(close_pool)
+  return _pool
+
+def chunk_size(num_jobs, cost, workers):
+  """replicas per task: cheap ones are grouped to amortise dispatch,
+  expensive ones go one at a time so the workers stay balanced
+  """
+  per_worker = math.ceil(num_jobs / workers)
+  return max(1, min(per_worker, TASK_COST // max(cost, 1)))
+
+def run_sims(func, args, cost):
+  """runs func over the argument tuples on the shared pool
+  cost is the estimated work of one replica, in arm-steps
+  replicas found in the result cache are not run again
+  """
+  cache = get_cache() if CACHE else None
+  if cache is None:
+    return compute_sims(func, args, cost)
+  keys = [cache.key(func, a) for a in args]
+  results = [cache.get(key) for key in keys]
+  missing = [i for i, result in enumerate(results) if result is None]
+  if missing:
+    computed = compute_sims(func, [args[i] for i in missing], cost)
+    for i, result in zip(missing, computed):
+      results[i] = result
+      cache.put(keys[i], result)
+    cache.trim()
+  return results
+
+def profile_sims(func, args, cost, profile):
+  """runs func with the instrumented loop, bypassing the cache, and
+  merges the workers' timings into profile
+  """
+  start = time.perf_counter_ns()
+  results = compute_sims(func, [a + (profile.settings(),) for a in args], cost)
+  profile.wall_ns += time.perf_counter_ns() - start
+  profile.workers = max(num_workers(), 1)
+  for _, worker_profile in results:
+    profile.merge(worker_profile)
+  return [result for result, _ in results]
+
+def sequential_sims(func, args, cost, test):
+  """runs the replicas in waves (one replica per worker, and at least
+  test.min_sims in the first), feeding test, until it decides or args run
+  out; replicas of later waves are never launched
+  """
+  wave = max(num_workers(), 1)
+  launched = 0
+  while launched < len(args) and test.look() is None:
+    size = max(wave, test.min_sims - launched)
+    for result in run_sims(func, args[launched:launched + size], cost):
+      test.add(result)
+    launched += size
+  test.look()
+  return test
+
+def compute_sims(func, args, cost):
+  workers = num_workers()
+  if workers == 0:
+    return [func(*a) for a in args]
+  return get_pool().starmap(func, args, chunk_size(len(args), cost, workers))
+
+def schedule_sims(jobs):
+  """runs (tag, func, args, cost) jobs from any number of simulations as one
+  queue on the shared pool, the most expensive first so that stragglers
+  start early; yields (tag, result) as each job finishes, cached ones first
+  """
+  cache = get_cache() if CACHE else None
+  pending = []
+  for tag, func, args, cost in jobs:
+    key = cache.key(func, args) if cache is not None else None
+    result = cache.get(key) if cache is not None else None
+    if result is not None:
+      yield tag, result
+    else:
+      pending.append((cost, tag, func, args, key))
+  pending.sort(key=lambda job: -job[0])
+  calls = [(i, func, args) for i, (_, _, func, args, _) in enumerate(pending)]
+  if num_workers() == 0:
+    finished = map(_run_job, calls)
+  else:
+    # one job per task, dispatched in the sorted order
+    finished = get_pool().imap_unordered(_run_job, calls)
+  for i, result in finished:
+    _, tag, _, _, key = pending[i]
+    if cache is not None:
+      cache.put(key, result)
+    yield tag, result
+  if cache is not None and pending:
+    cache.trim()
+
+def _run_job(call):
+  i, func, args = call
+  return i, func(*args)
+
+def uses_horizon(algorithm):
+  """whether the policy reads its horizon, in which case a shorter run is
+  not a prefix of a longer one; a class can say so with a uses_horizon
+  attribute, otherwise its source is searched for uses of horizon other
+  than self.horizon = horizon and passing horizon on to super().__init__
+  (the base classes are searched too); anything else, an alias of the
+  horizon included, counts as a use
+  """
+  algorithm = getattr(algorithm, 'func', algorithm)
+  if hasattr(algorithm, 'uses_horizon'):
+    return algorithm.uses_horizon
+  for cls in algorithm.__mro__:
+    if cls is object:
+      continue
+    try:
+      tree = ast.parse(textwrap.dedent(inspect.getsource(cls)))
+    except (OSError, TypeError):
+      # no source to look at, assume the worst
+      return True
+    ignored = set()
+    for node in ast.walk(tree):
+      if is_horizon_store(node):
+        ignored.update([id(node.targets[0]), id(node.value)])
+      if is_super_init(node):
+        ignored.update(id(arg) for arg in node.args if is_name(arg, 'horizon'))
+        ignored.update(id(k.value) for k in node.keywords
+          if k.arg == 'horizon' and is_name(k.value, 'horizon'))
+    for node in ast.walk(tree):
+      name = getattr(node, 'id', None) or getattr(node, 'attr', None)
+      if name == 'horizon' and id(node) not in ignored \
+          and isinstance(node, (ast.Name, ast.Attribute)):
+        return True
+  return False
+
+def is_name(node, name):
+  return isinstance(node, ast.Name) and node.id == name
+
+def is_horizon_store(node):
+  """self.horizon = horizon"""
+  return isinstance(node, ast.Assign) and len(node.targets) == 1 \
+    and isinstance(node.targets[0], ast.Attribute) and node.targets[0].attr == 'horizon' \
+    and is_name(node.targets[0].value, 'self') and is_name(node.value, 'horizon')
+
+def is_super_init(node):
+  """super().__init__(...)"""
+  return isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) \
+    and node.func.attr == '__init__' and isinstance(node.func.value, ast.Call) \
+    and is_name(node.func.value.func, 'super')
+
+def run_stops(algo_inst, bandit, stops):
+  """steps the policy against the bandit, yielding the regret at each stop"""
+  start = 0
+  for stop in stops:
+    for t in range(start, stop):
+      arm_to_be_pulled = algo_inst.give_pull()
+      reward = bandit.pull(arm_to_be_pulled)
+      algo_inst.get_reward(arm_index=arm_to_be_pulled, reward=reward)
+    start = stop
+    yield bandit.regret()
+
+def run_fast_stops(algo_inst, bandit, stops):
+  """run_stops for policies with a fast_forward mode: each give_run is a
+  run of pulls of one arm (cut at the next stop), drawn in one call
+  """
+  t = 0
+  for stop in stops:
+    while t < stop:
+      arm_to_be_pulled, num_pulls = algo_inst.give_run(stop - t)
+      successes = bandit.pull_many(arm_to_be_pulled, num_pulls)
+      algo_inst.get_rewards(arm_to_be_pulled, num_pulls, successes)
+      t += num_pulls
+    yield bandit.regret()
+
+def batch_counts(algo_inst, rng):
+  """whether a batched replica takes success counts, which are cheaper than
+  reward arrays: only if the policy accepts them, and only with a Generator
+  stream, as binomial(pulls, probs) draws differently from the per-pull
+  draws that legacy seeding must reproduce
+  """
+  return rng is not None and getattr(algo_inst, 'accepts_counts', False)
+
+def run_batch_stops(algo_inst, bandit, stops, counts=False):
+  """run_stops for batched policies, stops are counted in rounds
+  counts=True has the bandit return success counts (see batch_counts)
+  """
+  start = 0
+  for stop in stops:
+    for t in range(start, stop):
+      indices, num_pulls = algo_inst.give_pull()
+      rewards_dict = bandit.batch_pull(indices, num_pulls, counts)
+      algo_inst.get_reward(rewards_dict)
+    start = stop
+    yield bandit.regret()
+
+def record_trajectory(run, stops, trajectory, steps):
+  """runs to the stops while writing the regret every trajectory[2] steps
+  into row trajectory[1] of the file trajectory[0]; returns the regrets at
+  the stops
+  """
+  path, row, stride = trajectory
+  wanted = set(stops)
+  writer = TrajectoryWriter(path, row)
+  regrets = []
+  every = sorted(wanted.union(range(stride, steps + 1, stride)))
+  for stop, regret in zip(every, run(every)):
+    if stop % stride == 0:
+      writer.append(regret)
+    if stop in wanted:
+      regrets.append(regret)
+  writer.flush()
+  return regrets
+
+def share_probs(probs):
+  """probs as passed to the replicas: a SharedArray handle for large
+  instances that run on the pool, the values themselves otherwise
+  """
+  if num_workers() == 0 or len(probs) < SHARE_ARMS:
+    return probs
+  return share(np.asarray(probs, dtype=float))
+
+def replica_seeds(num_sims, legacy=None):
+  """seeds of the replicas, the same whichever worker runs which replica"""
+  if LEGACY if legacy is None else legacy:
+    return list(range(num_sims))
+  return [np.random.SeedSequence(ROOT_SEED, spawn_key=(i,)) for i in range(num_sims)]
+
+def replica_rng(seed):
+  """random source of one replica: a Generator for a SeedSequence seed, or
+  None after seeding the global np.random state with an int seed
+  """
+  if isinstance(seed, np.random.SeedSequence):
+    return np.random.Generator(np.random.PCG64(seed))
   np.random.seed(seed)
-  np.random.shuffle(PROBS)
-  bandit = BernoulliBandit(probs=PROBS)
-  algo_inst = ALGO(num_arms=len(PROBS), horizon=HORIZON)
-  for t in range(HORIZON):
+  return None
+
+def make_policy(ALGO, rng, **kwargs):
+  # policies only get an rng argument when there is one, so legacy runs
+  # also work with policies that do not take it
+  return ALGO(**kwargs) if rng is None else ALGO(rng=rng, **kwargs)
+
+def single_sim(seed=0, ALGO=Algorithm, PROBS=[0.3, 0.5, 0.7], HORIZON=1000, TAPE=False, CHECKPOINTS=None, PROFILE=None, TRAJECTORY=None):
+  rng = replica_rng(seed)
+  # the replica's order of the arms is shuffled as an index array, which
+  # draws the same permutation as shuffling the list; PROBS itself may be
+  # a read-only shared view and is never copied
+  PROBS = as_array(PROBS)
+  order = np.arange(len(PROBS))
+  (np.random if rng is None else rng).shuffle(order)
+  if TAPE:
+    # bandit and policy share one buffered stream (policy must accept rng)
+    rng = RandomTape(seed)
+  bandit = BernoulliBandit(probs=PROBS[order], rng=rng)
+  algo_inst = make_policy(ALGO, rng, num_arms=len(PROBS), horizon=HORIZON)
+  # regret is read off at every checkpoint on the way to the horizon
+  stops = [HORIZON] if CHECKPOINTS is None else sorted(CHECKPOINTS)
+  if PROFILE is not None:
+    # instrumented copy of the loop, returned with its profile
+    profile = Profile(*PROFILE)
+    regrets = profile.run(algo_inst, bandit, stops)
+    return (regrets[0] if CHECKPOINTS is None else regrets), profile
+  run = run_fast_stops if getattr(algo_inst, 'fast_forward', False) else run_stops
+  if TRAJECTORY is not None:
+    regrets = record_trajectory(lambda every: run(algo_inst, bandit, every),
+      stops, TRAJECTORY, HORIZON)
+  else:
+    regrets = list(run(algo_inst, bandit, stops))
+  return regrets[0] if CHECKPOINTS is None else regrets
+
+def single_uniform_sim(seed=0, ALGO=Algorithm, NUM_ARMS=1000):
+  rng = replica_rng(seed)
+  # arm means are generated on demand, horizon is the number of arms
+  bandit = UniformBandit(NUM_ARMS, seed, rng=rng)
+  algo_inst = make_policy(ALGO, rng, num_arms=NUM_ARMS, horizon=NUM_ARMS)
+  for t in range(NUM_ARMS):
     arm_to_be_pulled = algo_inst.give_pull()
     reward = bandit.pull(arm_to_be_pulled)
     algo_inst.get_reward(arm_index=arm_to_be_pulled, reward=reward)
   return bandit.regret()
 
-def single_batch_sim(seed=0, ALGO=Algorithm, PROBS=[0.3, 0.5, 0.7], HORIZON=1000, BATCH_SIZE=1):
-  np.random.seed(seed)
-  np.random.shuffle(PROBS)
-  bandit = BernoulliBandit(probs=PROBS, batch_size=BATCH_SIZE)
-  algo_inst = ALGO(num_arms=len(PROBS),
-    horizon=HORIZON, batch_size=BATCH_SIZE)
-  for t in range(HORIZON//BATCH_SIZE):
-    indices, num_pulls = algo_inst.give_pull()
-    rewards_dict = bandit.batch_pull(indices, num_pulls)
-    algo_inst.get_reward(rewards_dict)
-  return bandit.regret()
+def single_batch_sim(seed=0, ALGO=Algorithm, PROBS=[0.3, 0.5, 0.7], HORIZON=1000, BATCH_SIZE=1, PROFILE=None, TRAJECTORY=None):
+  rng = replica_rng(seed)
+  PROBS = as_array(PROBS)
+  order = np.arange(len(PROBS))
+  (np.random if rng is None else rng).shuffle(order)
+  bandit = BernoulliBandit(probs=PROBS[order], batch_size=BATCH_SIZE, rng=rng)
+  # legacy runs reproduce earlier versions, which always sampled
+  options = {'allocation': 'sample'} if rng is None \
+    and 'allocation' in inspect.signature(ALGO).parameters else {}
+  algo_inst = make_policy(ALGO, rng, num_arms=len(PROBS),
+    horizon=HORIZON, batch_size=BATCH_SIZE, **options)
+  rounds = HORIZON//BATCH_SIZE
+  counts = batch_counts(algo_inst, rng)
+  if PROFILE is not None:
+    profile = Profile(*PROFILE)
+    return profile.run(algo_inst, bandit, [rounds], batched=True, counts=counts)[0], profile
+  if TRAJECTORY is not None:
+    # the stride is given in pulls, the loop counts rounds
+    path, row, stride = TRAJECTORY
+    return record_trajectory(lambda every: run_batch_stops(algo_inst, bandit, every, counts),
+      [rounds], (path, row, stride // BATCH_SIZE), rounds)[0]
+  return list(run_batch_stops(algo_inst, bandit, [rounds], counts))[0]
+
+def aggregate_sim(seeds, ALGO, PROBS, HORIZON, CHECKPOINTS, SEPARATE=False, TAPE=False, K=128):
+  """runs a group of replicas, feeding each one's regrets at the
+  checkpoints into a partial RegretAggregate as it finishes
+  SEPARATE=True gives every checkpoint its own run with that horizon
+  """
+  aggregate = RegretAggregate(CHECKPOINTS, K)
+  for seed in seeds:
+    if SEPARATE:
+      aggregate.add([single_sim(seed, ALGO, PROBS, checkpoint, TAPE) for checkpoint in CHECKPOINTS])
+    else:
+      aggregate.add(single_sim(seed, ALGO, PROBS, HORIZON, TAPE, CHECKPOINTS))
+  return aggregate
+
+def simulate_stats(algorithm, probs, horizon, num_sims=50, checkpoints=None, tape=False, k=128, legacy=None):
+  """simulate, but returns a RegretAggregate (see aggregate.py) with the
+  mean, variance and quantile sketch of the regret at each checkpoint
+  workers send back partial aggregates of their replicas, which are merged
+  as they arrive, so memory stays constant in the number of replicas
+  """
+  checkpoints = [horizon] if checkpoints is None else sorted(checkpoints)
+  separate = len(checkpoints) > 1 and uses_horizon(algorithm)
+  cost = horizon * len(probs) * (len(checkpoints) if separate else 1)
+  workers = num_workers()
+  group = chunk_size(num_sims, cost, max(workers, 1))
+  seeds = replica_seeds(num_sims, legacy)
+  shared = share_probs(probs)
+  args = [(seeds[start:start + group], algorithm, shared, horizon,
+    checkpoints, separate, tape, k) for start in range(0, num_sims, group)]
+  if workers == 0:
+    partials = (aggregate_sim(*a) for a in args)
+  else:
+    partials = get_pool().imap_unordered(_aggregate_sim, args)
+  total = RegretAggregate(checkpoints, k)
+  for part in partials:
+    total.merge(part)
+  return total
+
+def _aggregate_sim(args):
+  return aggregate_sim(*args)
 
-def simulate(algorithm, probs, horizon, num_sims=50):
+def simulate(algorithm, probs, horizon, num_sims=50, lockstep=False, tape=False, checkpoints=None, profile=None, trajectory=None, stride=1, legacy=None,
+    threshold=None, confidence=0.95, max_sims=None, fast_forward=False):
   """simulates algorithm of class Algorithm
   for BernoulliBandit bandit, with horizon=horizon
+  every replica has its own Generator stream, or with legacy=True (default
+  LEGACY) the global np.random state seeded with its index
+  lockstep=True steps all replicas together in one process (see lockstep.py),
+  which always uses legacy per-replica streams
+  tape=True serves bandit and policy random numbers from a RandomTape
+  with a list of checkpoints (each at most horizon) the mean regret at each
+  of them is returned, from one pass unless the policy uses its horizon
+  a Profile passed as profile collects timings of the simulation loops
+  with a trajectory path, replica i streams its regret every stride steps
+  into row i of that memory-mapped .npy file (see trajectory.py)
+  with a threshold, replicas run only until a sequential bound at the given
+  confidence decides whether the mean regret is below or above it (at most
+  max_sims, by default num_sims), and the SequentialTest is returned
+  fast_forward=True lets the policy pull one arm many times per decision
+  when it can certify that it would (UCB); Thompson_Sampling only
+  has an approximate mode, which needs fast_forward='approximate'
   """
-  
-  def multiple_sims(num_sims=50):
-    with Pool(10) as pool:
-      regrets = pool.starmap(single_sim,
-        [(i, algorithm, probs, horizon) for i in range(num_sims)])
+  if fast_forward:
+    exact = getattr(getattr(algorithm, 'func', algorithm), 'fast_forward_exact', None)
+    assert exact is not None, "policy has no fast-forward mode"
+    assert exact or fast_forward == 'approximate', \
+      "fast-forward of this policy is approximate, pass fast_forward='approximate'"
+    # lockstep replicas are stepped one pull at a time
+    algorithm, lockstep = partial(algorithm, fast_forward=True), False
+  shared = share_probs(probs)
+  if threshold is not None:
+    assert checkpoints is None, "a threshold decides on the regret at the horizon"
+    return sequential_sims(single_sim,
+      [(seed, algorithm, shared, horizon, tape, None) for seed in replica_seeds(max_sims or num_sims, legacy)],
+      horizon * len(probs), SequentialTest(threshold, confidence))
+  if trajectory is not None:
+    # the file is the result, so this always runs and never uses the cache
+    create_trajectories(trajectory, num_sims, horizon // stride)
+    separate = checkpoints is not None and uses_horizon(algorithm)
+    regrets = np.mean(compute_sims(single_sim,
+      [(seed, algorithm, shared, horizon, tape, None if separate else checkpoints, None, (trajectory, i, stride))
+        for i, seed in enumerate(replica_seeds(num_sims, legacy))], horizon * len(probs)), axis=0)
+    if separate:
+      # the file holds runs to the horizon, the checkpoints need their own
+      return simulate(algorithm, probs, horizon, num_sims, lockstep, tape,
+        checkpoints=checkpoints, legacy=legacy)
     return regrets
+  if checkpoints is not None and uses_horizon(algorithm):
+    # every checkpoint needs its own run with that horizon
+    return np.array([simulate(algorithm, probs, checkpoint, num_sims, lockstep, tape,
+      profile=profile, legacy=legacy) for checkpoint in checkpoints])
+  if profile is not None:
+    return np.mean(profile_sims(single_sim,
+      [(seed, algorithm, shared, horizon, tape, checkpoints) for seed in replica_seeds(num_sims, legacy)],
+      horizon * len(probs), profile), axis=0)
+  if lockstep:
+    # all replicas are one job here, cached as a whole
+    regrets = run_sims(lockstep_sim,
+      [(algorithm, probs, horizon, num_sims, 0, checkpoints)], horizon * len(probs))[0]
+    return np.mean(regrets, axis=0)
+
+  def multiple_sims(num_sims=50):
+    return run_sims(single_sim,
+      [(seed, algorithm, shared, horizon, tape, checkpoints) for seed in replica_seeds(num_sims, legacy)],
+      horizon * len(probs))
+
+  return np.mean(multiple_sims(num_sims), axis=0)
+
+def multi_simulate(algorithm, instances, horizons, num_sims=50):
+  """mean regret of algorithm on each of many instances (lists of arm means,
+  of any lengths), with horizons one per instance or one for all
+  the instances are stepped together by lockstep.multi_sim, split into one
+  group of about equal work per worker; rewards use legacy streams as
+  lockstep=True does, and policy draws are keyed by the instance's index,
+  so the grouping (and the number of workers) does not change the results
+  """
+  if np.ndim(horizons) == 0:
+    horizons = [horizons] * len(instances)
+  costs = [horizon * len(probs) * num_sims for probs, horizon in zip(instances, horizons)]
+  # largest first, each to the group with the least work so far
+  groups = [[] for _ in range(min(max(num_workers(), 1), len(instances)))]
+  work = [0] * len(groups)
+  for j in sorted(range(len(instances)), key=lambda j: -costs[j]):
+    g = work.index(min(work))
+    groups[g].append(j)
+    work[g] += costs[j]
+  results = run_sims(multi_sim, [(algorithm, [list(instances[j]) for j in group],
+    [horizons[j] for j in group], num_sims, 0, group) for group in groups], max(work))
+  regrets = np.zeros(len(instances))
+  for group, result in zip(groups, results):
+    regrets[group] = np.mean(result, axis=1)
+  return regrets
+
+def uniform_simulate(algorithm, num_arms, num_sims=50, legacy=None):
+  """simulates algorithm of class Algorithm for a UniformBandit
+  with num_arms arms and horizon=num_arms (legacy as in simulate)
+  """
+
+  def multiple_sims(num_sims=50):
+    return run_sims(single_uniform_sim,
+      [(seed, algorithm, num_arms) for seed in replica_seeds(num_sims, legacy)], num_arms)
 
   return np.mean(multiple_sims(num_sims))
 
-def batch_simulate(algorithm, probs, horizon, batch_size, num_sims=50):
+def batch_simulate(algorithm, probs, horizon, batch_size, num_sims=50, profile=None, trajectory=None, stride=None, legacy=None,
+    threshold=None, confidence=0.95, max_sims=None, fast_forward=False):
   """simulates algorithm of class AlgorithmBatched
-  for BernoulliBandit bandit, with horizon=horizon
+  for BernoulliBandit bandit, with horizon=horizon (legacy as in simulate)
+  a Profile passed as profile collects timings of the simulation loops
+  with a trajectory path, replica i streams its regret after every stride
+  pulls (a multiple of batch_size, by default one round) into row i
+  threshold, confidence and max_sims stop early as in simulate
   """
+  shared = share_probs(probs)
+  if threshold is not None:
+    return sequential_sims(single_batch_sim,
+      [(seed, algorithm, shared, horizon, batch_size) for seed in replica_seeds(max_sims or num_sims, legacy)],
+      horizon * len(probs) // batch_size, SequentialTest(threshold, confidence))
+  if trajectory is not None:
+    stride = stride or batch_size
+    assert stride % batch_size == 0, "stride must be a multiple of batch size"
+    create_trajectories(trajectory, num_sims, horizon // stride)
+    return np.mean(compute_sims(single_batch_sim,
+      [(seed, algorithm, shared, horizon, batch_size, None, (trajectory, i, stride))
+        for i, seed in enumerate(replica_seeds(num_sims, legacy))], horizon * len(probs) // batch_size))
+  if profile is not None:
+    return np.mean(profile_sims(single_batch_sim,
+      [(seed, algorithm, shared, horizon, batch_size) for seed in replica_seeds(num_sims, legacy)],
+      horizon * len(probs) // batch_size, profile))
 
   def multiple_sims(num_sims=50):
-    with Pool(10) as pool:
-      regrets = pool.starmap(single_batch_sim,
-        [(i, algorithm, probs, horizon, batch_size) for i in range(num_sims)])
-    return regrets
+    return run_sims(single_batch_sim,
+      [(seed, algorithm, shared, horizon, batch_size) for seed in replica_seeds(num_sims, legacy)],
+      horizon * len(probs) // batch_size)
 
   return np.mean(multiple_sims(num_sims))
 
-def task1(algorithm, probs, num_sims=50):
+def save_result(name, result, plot=True):
+  """writes the numbers behind one plot to <name>-<time>.json and, with
+  plot=True, renders <name>-<time>.png from it (report.py is the only
+  module that imports matplotlib, and only when something is plotted)
+  """
+  stamp = time.strftime("%Y%m%d-%H%M%S")
+  path = "{}-{}.json".format(name, stamp)
+  with open(path, 'w') as f:
+    json.dump(dict(result, name=name, time=stamp), f, indent=2)
+  if plot:
+    import report
+    report.render(path)
+  return path
+
+def task1(algorithm, probs, num_sims=50, lockstep=False, trajectory=None, stride=64, bands=False, plot=True):
   """generates the plots and regrets for task1
+  lockstep=True steps the replicas together where there is an engine for
+  the policy, on legacy streams whatever the seeding (see simulate)
+  with a trajectory directory, the regret curves are kept there too
+  bands=True also keeps the 5th-95th percentile of the regret across
+  replicas and its median, from streaming aggregates
   """
   horizons = [2**i for i in range(10, 19)]
-  regrets = []
-  for horizon in horizons:
-    regrets.append(simulate(algorithm, probs, horizon, num_sims))
+  lockstep = lockstep and algorithm in LOCKSTEP
+  result = {'title': "Regret vs Horizon", 'x': horizons}
+  if bands:
+    aggregate = simulate_stats(algorithm, probs, horizons[-1], num_sims, checkpoints=horizons)
+    regrets = list(aggregate.stats.mean)
+    low, median, high = aggregate.quantiles()
+    result['bands'] = {'p05': low.tolist(), 'median': median.tolist(), 'p95': high.tolist()}
+  elif trajectory is not None:
+    path = os.path.join(trajectory, "task1-{}.npy".format(algorithm.__name__))
+    regrets = list(simulate(algorithm, probs, horizons[-1], num_sims,
+      checkpoints=horizons, trajectory=path, stride=stride))
+    result['curves'] = [(algorithm.__name__, path, stride)]
+  else:
+    regrets = list(simulate(algorithm, probs, horizons[-1], num_sims, lockstep,
+      checkpoints=horizons))
 
   print(regrets)
-  plt.plot(horizons, regrets)
-  plt.title("Regret vs Horizon")
-  plt.savefig("task1-{}-{}.png".format(algorithm.__name__, time.strftime("%Y%m%d-%H%M%S")))
-  plt.clf()
+  result['regret'] = [float(r) for r in regrets]
+  save_result("task1-{}".format(algorithm.__name__), result, plot)
 
-def task2(algorithm, probs, horizon=10000):
+def task2(algorithm, probs, horizon=10000, trajectory=None, plot=True):
   """generates the plots and regrets for task2
+  algorithm may be a list of batched policies, whose regret-vs-batch-size
+  curves are then plotted together
+  with a trajectory directory, the regret curves are kept there too
   """
   batch_sizes = [10, 20, 50, 100, 200, 500, 1000]
-  regrets = []
-  for batch_size in batch_sizes:
-    regrets.append(batch_simulate(
-      algorithm, probs, horizon, batch_size))
+  algorithms = algorithm if isinstance(algorithm, (list, tuple)) else [algorithm]
+  series = {}
+  curves = []
+  for algorithm in algorithms:
+    name = algorithm.__name__
+    regrets = []
+    for batch_size in batch_sizes:
+      path = None
+      if trajectory is not None:
+        if len(algorithms) > 1:
+          path = os.path.join(trajectory, "task2-{}-{}.npy".format(name, batch_size))
+          curves.append(("{} {}".format(name, batch_size), path, batch_size))
+        else:
+          path = os.path.join(trajectory, "task2-{}.npy".format(batch_size))
+          curves.append((str(batch_size), path, batch_size))
+      regrets.append(float(batch_simulate(
+        algorithm, probs, horizon, batch_size, trajectory=path)))
+    if len(algorithms) > 1:
+      print(name, regrets)
+    else:
+      print(regrets)
+    series[name] = regrets
 
-  print(regrets)
-  plt.plot(batch_sizes, regrets)
-  plt.title("Regret vs Batch Size")
-  plt.savefig("task2-{}.png".format(time.strftime("%Y%m%d-%H%M%S")))
-  plt.clf()
+  result = {'title': "Regret vs Batch Size", 'x': batch_sizes, 'regret': series[algorithms[0].__name__]}
+  if len(algorithms) > 1:
+    result['series'] = series
+  if curves:
+    result['curves'] = curves
+  save_result("task2", result, plot)
 
-def task3(algorithm):
+def task3(algorithm, lazy=False, trajectory=None, plot=True):
   """generates the plots and regrets for task3
+  lazy=True draws the arm means on demand (UniformBandit) instead of
+  building and shuffling the list of probabilities
+  with a trajectory directory, the regret curves are kept there too
   """
   horizons = [1000, 5000, 10000, 15000, 20000, 30000]
   regrets = []
+  curves = []
   for horizon in horizons:
+    if lazy:
+      regrets.append(uniform_simulate(algorithm, horizon))
+      continue
     probs = [i/horizon for i in range(horizon)]
-    regrets.append(simulate(algorithm, probs, horizon))
+    path = None
+    if trajectory is not None:
+      path = os.path.join(trajectory, "task3-{}.npy".format(horizon))
+      curves.append((str(horizon), path, 1))
+    regrets.append(simulate(algorithm, probs, horizon, trajectory=path))
 
   print(regrets)
-  plt.plot(horizons, regrets)
-  plt.title("Regret vs Horizon=NUM_ARMS")
-  plt.savefig("task3-{}.png".format(time.strftime("%Y%m%d-%H%M%S")))
-  plt.clf()
+  result = {'title': "Regret vs Horizon=NUM_ARMS", 'x': horizons, 'regret': [float(r) for r in regrets]}
+  if curves:
+    result['curves'] = curves
+  save_result("task3", result, plot)
 
 
 if __name__ == '__main__':
@@ -115,6 +660,7 @@ if __name__ == '__main__':
 #   task1(Thompson_Sampling, probs)
 
 #   task2(AlgorithmBatched, probs)
+#   task2([Batched_UCB, Batched_KL_UCB, Batched_Thompson_Sampling, AlgorithmBatched], probs)
 
 #   task3(AlgorithmManyArms)
 
@@ -5,9 +5,11 @@ NOTE: You are only allowed to edit this file between the lines that say:
 
 This file contains the base Algorithm class that all algorithms should inherit
 from. Here are the method details:
-    - __init__(self, num_arms, horizon): This method is called when the class
-        is instantiated. Here, you can add any other member variables that you
-        need in your algorithm.
+    - __init__(self, num_arms, horizon, rng=None): This method is called when
+        the class is instantiated. Here, you can add any other member variables
+        that you need in your algorithm. rng is where random numbers come from,
+        np.random by default, a np.random.Generator or a RandomTape (see
+        rng_tape.py); self.randint draws random integers from any of them.
     
     - give_pull(self): This method is called when the algorithm needs to
         select an arm to pull. The method should return the index of the arm
@@ -17,6 +19,12 @@ from. Here are the method details:
         give_pull method. The method should update the algorithm's internal
         state based on the arm that was pulled and the reward that was received.
         (The value of arm_index is the same as the one returned by give_pull.)
+    
+    - give_run(self, limit) and get_rewards(self, arm_index, num_pulls,
+        successes): Optional, used when the policy is built with
+        fast_forward=True. give_run returns the next arm and how many pulls
+        in a row (at most limit) it gets, get_rewards takes the number of
+        successes of those pulls.
 
 We have implemented the epsilon-greedy algorithm for you. You can use it as a
 reference for implementing your own algorithms.
@@ -27,9 +35,12 @@ import math
 # Hint: math.log is much faster than np.log for scalars
 
 class Algorithm:
-    def __init__(self, num_arms, horizon):
+    def __init__(self, num_arms, horizon, rng=None):
         self.num_arms = num_arms
         self.horizon = horizon
+        self.rng = np.random if rng is None else rng
+        # Generator calls it integers, np.random and RandomTape randint
+        self.randint = getattr(self.rng, 'integers', None) or self.rng.randint
     
     def give_pull(self):
         raise NotImplementedError
@@ -39,16 +50,16 @@ class Algorithm:
 
 # Example implementation of Epsilon Greedy algorithm
 class Eps_Greedy(Algorithm):
-    def __init__(self, num_arms, horizon):
-        super().__init__(num_arms, horizon)
+    def __init__(self, num_arms, horizon, rng=None):
+        super().__init__(num_arms, horizon, rng)
         # Extra member variables to keep track of the state
         self.eps = 0.1
         self.counts = np.zeros(num_arms)
         self.values = np.zeros(num_arms)
     
     def give_pull(self):
-        if np.random.random() < self.eps:
-            return np.random.randint(self.num_arms)
+        if self.rng.random() < self.eps:
+            return self.randint(self.num_arms)
         else:
             return np.argmax(self.values)
     
@@ -64,31 +75,53 @@ class Eps_Greedy(Algorithm):
 
 # function to calculate empirical means using rewards and pulls
 def getEmpMean(arms, rewards, pulls):
-    empMean = []
-    for i in range(arms):
-        if pulls[i] == 0:
-            # arm has not yet been pulled
-            empMean.append(1e5)
-        else:
-            # updated empirical mean
-            empMean.append(rewards[i] / pulls[i])
-    # convert to numpy array
-    return np.array(empMean)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # arms not yet pulled get a large placeholder
+        return np.where(pulls == 0, 1e5, rewards / pulls)
 
 # function to calculate extra term in UCB
 def getUCBUncert(arms, time, pulls):
     # numerator to find horizon/time factor
     num = math.sqrt(2 * math.log(time))
-    uncert = []
-    for i in range(arms):
-        if pulls[i] == 0:
-            # arm has not yet been pulled
-            uncert.append(1e5)
-        else:
-            # updated uncertainty
-            uncert.append(num / math.sqrt(pulls[i]))
-    # convert to numpy array
-    return np.array(uncert)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # arms not yet pulled get a large placeholder
+        return np.where(pulls == 0, 1e5, num / np.sqrt(pulls))
+
+# tournament tree over arm indices, keeps the argmax of the leaf values
+# so that changing one arm costs O(log K) instead of a full np.argmax
+class ArgmaxTree:
+    def __init__(self, values):
+        self.size = 1
+        while self.size < len(values):
+            self.size *= 2
+        # leaves beyond the last arm can never win
+        self.values = np.full(self.size, -np.inf)
+        self.best = np.zeros(2 * self.size, dtype=np.int64)
+        self.rebuild(values)
+
+    def rebuild(self, values):
+        # refresh every leaf and replay the tournament level by level
+        self.values[:len(values)] = values
+        self.best[self.size:] = np.arange(self.size)
+        lo = self.size
+        while lo > 1:
+            left = self.best[lo:2 * lo:2]
+            right = self.best[lo + 1:2 * lo:2]
+            # ties go to the left, matching np.argmax
+            self.best[lo // 2:lo] = np.where(self.values[left] >= self.values[right], left, right)
+            lo //= 2
+
+    def update(self, index, value):
+        # change one leaf and replay only its path to the root
+        self.values[index] = value
+        node = (index + self.size) // 2
+        while node >= 1:
+            left, right = self.best[2 * node], self.best[2 * node + 1]
+            self.best[node] = left if self.values[left] >= self.values[right] else right
+            node //= 2
+
+    def argmax(self):
+        return self.best[1]
 
 # function to calculate KL-divergence
 def KL(p, q):
@@ -102,7 +135,7 @@ def KL(p, q):
     return p * math.log(p / q) + (1 - p) * math.log((1 - p) / (1 - q))
 
 # function to binary search for maximum value
-def getUCBKLUncert(time, c, p, pulls):
+def getUCBKLUncert(time, c, p, pulls, tol=1e-3):
     if (pulls == 0):
         # arm has not yet been pulled
         return (1 + p) / 2
@@ -111,7 +144,7 @@ def getUCBKLUncert(time, c, p, pulls):
     l = p
     r = 1
     # searching for the largest allowed value
-    while r - l > 1e-3:
+    while r - l > tol:
         q = (l + r) / 2
         # find divergence
         kl = KL(p,q)
@@ -123,79 +156,246 @@ def getUCBKLUncert(time, c, p, pulls):
             r = q
     # found value
     return (l + r) / 2
+
+# below this many arms the scalar search beats the array one
+KL_VEC_ARMS = 16
+
+# function to binary search the KL-UCB index of all arms at once
+def getUCBKLIndex(time, c, empMean, pulls, tol=1e-3):
+    unpulled = pulls == 0
+    if unpulled.all():
+        # arms not yet pulled, log(log(time)) may not be defined
+        return (1 + empMean) / 2
+    # upper bound for the divergence of every arm
+    logt = math.log(time)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        bound = (logt + c * math.log(logt)) / pulls
+        p = np.where(unpulled, 0, empMean)
+        # part of the divergence that depends only on p (zero at p = 0, 1)
+        ent = np.nan_to_num(p * np.log(p)) + np.nan_to_num((1 - p) * np.log(1 - p))
+    l = p.copy()
+    r = np.ones_like(p)
+    # each arm keeps searching until its own interval is small enough
+    active = (r - l > tol) & ~unpulled
+    with np.errstate(divide='ignore', invalid='ignore'):
+        while active.any():
+            q = (l + r) / 2
+            # find divergence, KL(p, q) = ent - p log q - (1 - p) log (1 - q)
+            within = ent - p * np.log(q) - (1 - p) * np.log(1 - q) < bound
+            # move interval ahead or behind, only for arms still searching
+            np.copyto(l, q, where=active & within)
+            np.copyto(r, q, where=active & ~within)
+            active &= r - l > tol
+    # found values, arms not yet pulled as in getUCBKLUncert
+    return np.where(unpulled, (1 + empMean) / 2, (l + r) / 2)
+
+# function to find the longest run, up to limit, for which ok holds
+# (ok must hold up to some length and fail beyond it)
+def getRunLength(ok, limit):
+    if limit <= 1 or not ok(2):
+        return 1
+    # double until ok fails or the limit is passed
+    lo, hi = 2, 4
+    while hi <= limit and ok(hi):
+        lo, hi = hi, 2 * hi
+    hi = min(hi, limit + 1)
+    # then bisect between the last success and the first failure
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if ok(mid):
+            lo = mid
+        else:
+            hi = mid
+    return lo
+
+# function to estimate the chance that a Thompson sample of some other arm
+# beats the given arm, from normal approximations of the Beta posteriors
+# and a union bound over the other arms
+def getLeaveProb(arm, a, b):
+    mean = a / (a + b)
+    var = a * b / ((a + b) ** 2 * (a + b + 1))
+    z = (mean[arm] - np.delete(mean, arm)) / np.sqrt(var[arm] + np.delete(var, arm))
+    return min(1.0, sum(0.5 * math.erfc(x / math.sqrt(2)) for x in z))
 # END EDITING HERE
 
 class UCB(Algorithm):
-    def __init__(self, num_arms, horizon):
-        super().__init__(num_arms, horizon)
+    # runs given by give_run are certain, not approximate
+    fast_forward_exact = True
+
+    def __init__(self, num_arms, horizon, tree_tol=None, rng=None, fast_forward=False):
+        super().__init__(num_arms, horizon, rng)
         # You can add any other variables you need here
         # START EDITING HERE
         self.num_pulls = 0
         self.pulls = np.zeros(self.num_arms)
         self.rewards = np.zeros(self.num_arms)
+        # with tree_tol set, indices live in an ArgmaxTree and are only all
+        # recomputed once log(t) has grown by that fraction since the last time
+        self.tree_tol = tree_tol
+        self.tree = None
+        self.tree_time = 0
+        # with fast_forward set, give_run certifies runs of the same arm;
+        # after a failed attempt the next few pulls skip the check, twice as
+        # many after each further failure
+        self.fast_forward = fast_forward
+        self.skip = 0
+        self.backoff = 1
         # END EDITING HERE
     
+    def index(self, arm_index, time):
+        # START EDITING HERE
+        # UCB value of a single arm at the given time
+        if self.pulls[arm_index] == 0:
+            return 2e5
+        return self.rewards[arm_index] / self.pulls[arm_index] + math.sqrt(2 * math.log(time)) / math.sqrt(self.pulls[arm_index])
+        # END EDITING HERE
+
+    def refresh(self, values):
+        # START EDITING HERE
+        # load freshly computed indices of all arms into the tree
+        if self.tree is None:
+            self.tree = ArgmaxTree(values)
+        else:
+            self.tree.rebuild(values)
+        # END EDITING HERE
+
     def give_pull(self):
         # START EDITING HERE
         self.num_pulls += 1
+        if self.tree_tol is not None:
+            if self.tree is None or math.log(self.num_pulls) > (1 + self.tree_tol) * math.log(self.tree_time):
+                # log(t) moved too far, refresh every arm
+                self.tree_time = self.num_pulls
+                ucb = getEmpMean(self.num_arms,self.rewards,self.pulls) + getUCBUncert(self.num_arms,self.num_pulls,self.pulls)
+                self.refresh(ucb)
+            return self.tree.argmax()
         # get the UCB value for this arm at the given time (modeled by number of pulls)
         ucb = getEmpMean(self.num_arms,self.rewards,self.pulls) + getUCBUncert(self.num_arms,self.num_pulls,self.pulls)
         # return index of the largest/optimal
         return np.argmax(ucb)
         # END EDITING HERE
+
+    def bounds(self, arm_index, length):
+        # START EDITING HERE
+        # lowest UCB value of the arm over its next length pulls (all of
+        # them failures, log(t) kept at its current value) and the highest
+        # any other arm reaches by the end of them
+        n = self.pulls[arm_index] + length - 1
+        low = self.rewards[arm_index] / n + math.sqrt(2 * math.log(self.num_pulls) / n)
+        ucb = self.rewards / self.pulls + math.sqrt(2 * math.log(self.num_pulls + length - 1)) / np.sqrt(self.pulls)
+        ucb[arm_index] = -np.inf
+        return low, np.max(ucb)
+        # END EDITING HERE
+
+    def give_run(self, limit):
+        # START EDITING HERE
+        # the next arm to pull, and how many pulls in a row (at most limit)
+        # it is certain to get whatever their rewards
+        arm_index = self.give_pull()
+        if not self.fast_forward or self.tree_tol is not None or self.num_pulls < 3 or (self.pulls == 0).any():
+            return arm_index, 1
+        if self.skip > 0:
+            self.skip -= 1
+            return arm_index, 1
+        def ok(length):
+            low, high = self.bounds(arm_index, length)
+            return low > high + 1e-9
+        length = getRunLength(ok, limit)
+        if length == 1:
+            self.skip = self.backoff
+            self.backoff = min(2 * self.backoff, 256)
+        else:
+            self.backoff = 1
+        # the clock moves on over the whole run
+        self.num_pulls += length - 1
+        return arm_index, length
+        # END EDITING HERE
+
+    def get_rewards(self, arm_index, num_pulls, successes):
+        # START EDITING HERE
+        # update after a run of num_pulls pulls of one arm
+        self.pulls[arm_index] += num_pulls
+        self.rewards[arm_index] += successes
+        if self.tree is not None and self.tree_time > 1:
+            self.tree.update(arm_index, self.index(arm_index, self.tree_time))
+        # END EDITING HERE
     
     def get_reward(self, arm_index, reward):
         # START EDITING HERE
         # update the pulls and record reward obtained
         self.pulls[arm_index] += 1
         self.rewards[arm_index] += reward
+        if self.tree is not None and self.tree_time > 1:
+            # only the pulled arm changed since the last refresh
+            # (a tree built at t = 1 is always refreshed at t = 2)
+            self.tree.update(arm_index, self.index(arm_index, self.tree_time))
         # END EDITING HERE
 
-class KL_UCB(Algorithm):
-    def __init__(self, num_arms, horizon):
-        super().__init__(num_arms, horizon)
+class KL_UCB(UCB):
+    # no fast-forward mode: certifying a run costs more index searches
+    # than the steps it saves
+    fast_forward_exact = None
+
+    def __init__(self, num_arms, horizon, tree_tol=None, rng=None):
+        super().__init__(num_arms, horizon, tree_tol, rng)
         # You can add any other variables you need here
         # START EDITING HERE
-        self.num_pulls = 0
-        self.pulls = np.zeros(self.num_arms)
-        self.rewards = np.zeros(self.num_arms)
         self.c = 3
+        # tolerance of the index search
+        self.tol = 1e-3
         # END EDITING HERE
     
+    def index(self, arm_index, time):
+        # START EDITING HERE
+        # KL-UCB value of a single arm at the given time
+        if self.pulls[arm_index] == 0:
+            return (1 + 1e5) / 2
+        return getUCBKLUncert(time,self.c,self.rewards[arm_index] / self.pulls[arm_index],self.pulls[arm_index],self.tol)
+        # END EDITING HERE
+
     def give_pull(self):
         # START EDITING HERE
         self.num_pulls += 1
+        if self.tree_tol is not None:
+            if self.tree is None or math.log(self.num_pulls) > (1 + self.tree_tol) * math.log(self.tree_time):
+                # log(t) moved too far, refresh every arm
+                self.tree_time = self.num_pulls
+                empMean = getEmpMean(self.num_arms,self.rewards,self.pulls)
+                self.refresh(getUCBKLIndex(self.num_pulls,self.c,empMean,self.pulls,self.tol))
+            return self.tree.argmax()
         # get the empirical means
         empMean = getEmpMean(self.num_arms,self.rewards,self.pulls)
-        ucbkl = []
-        for i in range(self.num_arms):
+        if self.num_arms < KL_VEC_ARMS:
             # iterate over the arms and find the maximum value for ucb-kl for each
-            ucbkl.append(getUCBKLUncert(self.num_pulls,self.c,empMean[i],self.pulls[i]))
+            ucbkl = [getUCBKLUncert(self.num_pulls,self.c,empMean[i],self.pulls[i],self.tol) for i in range(self.num_arms)]
+        else:
+            # find the maximum value for ucb-kl for all arms together
+            ucbkl = getUCBKLIndex(self.num_pulls,self.c,empMean,self.pulls,self.tol)
         # return index of the largest/optimal
-        return np.argmax(np.array(ucbkl))
-        # END EDITING HERE
-    
-    def get_reward(self, arm_index, reward):
-        # START EDITING HERE
-        # update the pulls and record reward obtained
-        self.pulls[arm_index] += 1
-        self.rewards[arm_index] += reward
+        return np.argmax(ucbkl)
         # END EDITING HERE
 
 
 class Thompson_Sampling(Algorithm):
-    def __init__(self, num_arms, horizon):
-        super().__init__(num_arms, horizon)
+    # runs given by give_run only approximate the policy
+    fast_forward_exact = False
+
+    def __init__(self, num_arms, horizon, rng=None, fast_forward=False):
+        super().__init__(num_arms, horizon, rng)
         # You can add any other variables you need here
         # START EDITING HERE
         self.pulls = np.zeros(self.num_arms)
         self.rewards = np.zeros(self.num_arms)
+        # APPROXIMATE: with fast_forward set, give_run draws the length of a
+        # run of the sampled arm instead of sampling at every pull
+        self.fast_forward = fast_forward
+        self.last = None
         # END EDITING HERE
     
     def give_pull(self):
         # START EDITING HERE
         # get the values using beta distribution on each
-        thmpsn = np.random.beta(self.rewards + 1,self.pulls - self.rewards + 1)
+        thmpsn = self.rng.beta(self.rewards + 1,self.pulls - self.rewards + 1)
         # return index of the largest/optimal
         return np.argmax(thmpsn)
         # END EDITING HERE
@@ -206,3 +406,23 @@ class Thompson_Sampling(Algorithm):
         self.pulls[arm_index] += 1
         self.rewards[arm_index] += reward
         # END EDITING HERE
+
+    def give_run(self, limit):
+        # START EDITING HERE
+        # APPROXIMATE: once the same arm is sampled twice in a row, the
+        # pulls until another arm would win are drawn as a geometric count,
+        # with the chance of leaving frozen at the start of the run
+        arm_index = self.give_pull()
+        if not self.fast_forward or arm_index != self.last:
+            self.last = arm_index
+            return arm_index, 1
+        leave = getLeaveProb(arm_index, self.rewards + 1, self.pulls - self.rewards + 1)
+        return arm_index, min(int(self.rng.geometric(max(leave, 1e-12))), limit)
+        # END EDITING HERE
+
+    def get_rewards(self, arm_index, num_pulls, successes):
+        # START EDITING HERE
+        # update after a run of num_pulls pulls of one arm
+        self.pulls[arm_index] += num_pulls
+        self.rewards[arm_index] += successes
+        # END EDITING HERE
@@ -19,44 +19,250 @@ You need to complete the following methods:
         from arm_indices to a list of rewards received. For example, if the
         give_pull method returned ([0, 1], [2, 3]), then arm_rewards will be
         {0: [r1, r2], 1: [r3, r4, r5]}. (r1 to r5 are each either 0 or 1.)
+        It may instead be an array with the number of successes of each arm
+        returned by give_pull, as batch_pull(..., counts=True) gives.
 """
 
 import numpy as np
+import math
 
 # START EDITING HERE
 # You can use this space to define any helper functions that you need.
+
+# batch size from which the analytic allocation is used by default
+ANALYTIC_BATCH = 5000
+# number of grid points for the probability-of-best integral
+GRID = 1024
+
+# function to find the probability of each arm having the largest sample
+# from its Beta(a, b) posterior, by integrating on a grid
+def getProbBest(a, b):
+    mean = a / (a + b)
+    sd = np.sqrt(a * b / ((a + b) ** 2 * (a + b + 1)))
+    # only the region where the best arm can be matters
+    lo = max(0.0, np.max(mean - 6 * sd))
+    hi = min(1.0, np.max(mean + 6 * sd))
+    dx = (hi - lo) / GRID
+    x = lo + (np.arange(GRID) + 0.5) * dx
+    # log normaliser of each posterior
+    lbeta = np.array([math.lgamma(i) + math.lgamma(j) - math.lgamma(i + j) for i, j in zip(a, b)])
+    # mass of each arm in every cell of the grid
+    mass = np.exp((a[:, None] - 1) * np.log(x) + (b[:, None] - 1) * np.log(1 - x) - lbeta[:, None]) * dx
+    # cdf at the cell centres, from the mass above (nothing sits above hi)
+    above = np.cumsum(mass[:, ::-1], axis=1)[:, ::-1] - mass / 2
+    logcdf = np.log(np.clip(1 - above, 1e-300, 1))
+    # every other arm below x while this one is at x
+    best = (mass * np.exp(logcdf.sum(axis=0) - logcdf)).sum(axis=1)
+    return best / best.sum()
+
+# function to split a batch in proportion to the given weights
+def getAllocation(weights, batch_size):
+    counts = np.floor(weights * batch_size).astype(np.int64)
+    # remaining pulls go to the largest remainders
+    remainder = weights * batch_size - counts
+    counts[np.argsort(-remainder)[:batch_size - counts.sum()]] += 1
+    return counts
 # END EDITING HERE
 
 class AlgorithmBatched:
-    def __init__(self, num_arms, horizon, batch_size):
+    # get_reward understands success counts as well as reward dicts
+    accepts_counts = True
+
+    def __init__(self, num_arms, horizon, batch_size, rng=None, allocation=None):
         self.num_arms = num_arms
         self.horizon = horizon
         self.batch_size = batch_size
         assert self.horizon % self.batch_size == 0, "Horizon must be a multiple of batch size"
         # START EDITING HERE
         # Add any other variables you need here
+        self.rng = np.random if rng is None else rng
         self.pulls = np.zeros(self.num_arms)
         self.rewards = np.zeros(self.num_arms)
+        # 'sample' draws a posterior sample for each pull in the batch,
+        # 'analytic' splits the batch by each arm's probability of being best
+        if allocation is None:
+            allocation = 'sample' if batch_size < ANALYTIC_BATCH else 'analytic'
+        assert allocation in ('sample', 'analytic'), "Unknown allocation %s" % allocation
+        self.allocation = allocation
+        # arms and pulls of the last batch, to match counts from get_reward
+        self.indices = None
+        self.num_pulls = None
         # END EDITING HERE
-    
+
     def give_pull(self):
         # START EDITING HERE
-        choices = {}
-        for _ in range(self.batch_size):
-            # choose random arm for each iteration of batch size
-            thmpsn = np.random.beta(self.rewards + 1,self.pulls - self.rewards + 1)
-            arm = np.argmax(thmpsn)
-            # record the choice into a dictionary
-            choices.setdefault(arm,0)
-            choices[arm] += 1
-        # return lists of indices and counts
-        return np.array(list(choices.keys())), np.array(list(choices.values()))
+        a = self.rewards + 1
+        b = self.pulls - self.rewards + 1
+        if self.allocation == 'analytic':
+            counts = getAllocation(getProbBest(a, b), self.batch_size)
+        else:
+            # one posterior sample per pull of the batch, all drawn together
+            thmpsn = self.rng.beta(a, b, (self.batch_size, self.num_arms))
+            choices = np.argmax(thmpsn, axis=1)
+            counts = np.bincount(choices, minlength=self.num_arms)
+            # arms in the order they were first chosen, the order rewards
+            # are drawn in
+            self.indices = choices[np.sort(np.unique(choices, return_index=True)[1])]
+            self.num_pulls = counts[self.indices]
+            return self.indices, self.num_pulls
+        # return arrays of indices and counts
+        self.indices = np.flatnonzero(counts)
+        self.num_pulls = counts[self.indices]
+        return self.indices, self.num_pulls
         # END EDITING HERE
     
     def get_reward(self, arm_rewards):
         # START EDITING HERE
         # update the pulls and record reward obtained
-        for arm, res in arm_rewards.items():
-            self.pulls[arm] += len(res)
-            self.rewards[arm] += np.sum(res)
-        # END EDITING HERE
\ No newline at end of file
+        if isinstance(arm_rewards, dict):
+            arms = np.fromiter(arm_rewards.keys(), dtype=np.int64, count=len(arm_rewards))
+            self.pulls[arms] += [len(res) for res in arm_rewards.values()]
+            self.rewards[arms] += [np.sum(res) for res in arm_rewards.values()]
+        else:
+            # successes of the arms returned by the last give_pull
+            self.pulls[self.indices] += self.num_pulls
+            self.rewards[self.indices] += arm_rewards
+        # END EDITING HERE
+
+# START EDITING HERE
+# batched versions of the task1 policies: one index evaluation per round,
+# with the batch split so that every arm's index, counting the pulls it is
+# about to get, ends up at a common level (UCB, KL-UCB), or by posterior
+# sampling (Thompson Sampling)
+from task1 import getUCBKLIndex
+
+# at most this many false position steps for the common index level
+LEVEL_STEPS = 50
+# largest number of arms times batch size for which the indices of every
+# arm after each number of extra pulls are all computed
+INDEX_ENTRIES = 1 << 15
+
+class BatchedIndex(AlgorithmBatched):
+    def __init__(self, num_arms, horizon, batch_size, rng=None):
+        super().__init__(num_arms, horizon, batch_size, rng)
+
+    def index(self, time, extra=0):
+        # index of each arm after extra more pulls with the same mean
+        raise NotImplementedError
+
+    def need(self, level, time):
+        # pulls each arm can take before its index falls to level
+        raise NotImplementedError
+
+    def share(self, level, time):
+        # no arm takes more than the whole batch
+        return np.minimum(self.need(level, time), self.batch_size)
+
+    def give_pull(self):
+        unpulled = np.flatnonzero(self.pulls == 0)
+        if len(unpulled):
+            # every arm is tried before any index is used
+            weights = np.zeros(self.num_arms)
+            weights[unpulled] = 1 / len(unpulled)
+            counts = getAllocation(weights, self.batch_size)
+        else:
+            # indices are for the time at the end of the batch
+            time = self.pulls.sum() + self.batch_size
+            if self.num_arms * self.batch_size <= INDEX_ENTRIES:
+                counts = self.top_pulls(time)
+            else:
+                counts = self.level_pulls(time)
+        self.indices = np.flatnonzero(counts)
+        self.num_pulls = counts[self.indices]
+        return self.indices, self.num_pulls
+
+    def top_pulls(self, time):
+        # indices only fall with more pulls, so the batch goes to the
+        # batch_size largest indices after 0, 1, ... extra pulls
+        index = self.index(time, np.arange(self.batch_size)[:, None])
+        top = np.argpartition(-index, self.batch_size - 1, axis=None)[:self.batch_size]
+        return np.bincount(top % self.num_arms, minlength=self.num_arms)
+
+    def level_pulls(self, time):
+        # pulls up to a common index level, found by false position
+        mean = self.rewards / self.pulls
+        index = self.index(time)
+        # the level lies between the best mean and the best index, where
+        # the arms' shares add up to at most the batch
+        lo, hi = mean.max(), index.max()
+        low, high = self.share(lo, time), self.share(hi, time)
+        # approximate indices can leave hi too low, move it up until the
+        # shares fit in the batch
+        step = hi - lo
+        for _ in range(LEVEL_STEPS):
+            if high.sum() <= self.batch_size:
+                break
+            lo, low = hi, high
+            hi, step = hi + step, 2 * step
+            high = self.share(hi, time)
+        # false position on the pulls over the batch (Illinois: an end
+        # kept twice in a row has its excess halved)
+        over_lo, over_hi = low.sum() - self.batch_size, high.sum() - self.batch_size
+        kept = 0
+        for _ in range(LEVEL_STEPS):
+            # whole pulls are settled once no arm gains one in between
+            if over_hi == 0 or np.array_equal(np.floor(low), np.floor(high)):
+                break
+            mid = (lo * over_hi - hi * over_lo) / (over_hi - over_lo)
+            if not lo < mid < hi:
+                mid = (lo + hi) / 2
+            share = self.share(mid, time)
+            over = share.sum() - self.batch_size
+            if over > 0:
+                lo, low, over_lo = mid, share, over
+                kept = min(kept, 0) - 1
+                if kept < -1:
+                    over_hi /= 2
+            else:
+                hi, high, over_hi = mid, share, over
+                kept = max(kept, 0) + 1
+                if kept > 1:
+                    over_lo /= 2
+        if high.sum() > self.batch_size:
+            # no level fits (an arm with no failures takes any number
+            # of pulls), the batch is split in proportion to the shares
+            counts = getAllocation(high / high.sum(), self.batch_size)
+        else:
+            counts = np.floor(high).astype(np.int64)
+        left = self.batch_size - counts.sum()
+        if left:
+            # the pulls left go to the largest remainders, then to the
+            # best indices
+            order = np.lexsort((-index, counts - high))
+            counts[order[:left]] += 1
+        return counts
+
+class Batched_UCB(BatchedIndex):
+    def index(self, time, extra=0):
+        return self.rewards / self.pulls + np.sqrt(2 * math.log(time) / (self.pulls + extra))
+
+    def need(self, level, time):
+        # mean + sqrt(2 log t / n) = level at n = 2 log t / (level - mean)^2
+        gap = np.maximum(level - self.rewards / self.pulls, 1e-12)
+        return np.maximum(2 * math.log(time) / gap ** 2 - self.pulls, 0)
+
+class Batched_KL_UCB(BatchedIndex):
+    def __init__(self, num_arms, horizon, batch_size, rng=None):
+        super().__init__(num_arms, horizon, batch_size, rng)
+        self.c = 3
+        self.tol = 1e-3
+
+    def index(self, time, extra=0):
+        pulls = self.pulls + extra
+        mean = np.broadcast_to(self.rewards / self.pulls, pulls.shape)
+        return getUCBKLIndex(time, self.c, mean, pulls, self.tol)
+
+    def need(self, level, time):
+        # n KL(mean, level) = log t + c log log t
+        p = self.rewards / self.pulls
+        level = min(level, 1 - 1e-12)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            kl = np.nan_to_num(p * np.log(p / level)) + np.nan_to_num((1 - p) * np.log((1 - p) / (1 - level)))
+            need = (math.log(time) + self.c * math.log(math.log(time))) / kl - self.pulls
+        return np.where(p < level, np.maximum(need, 0), np.inf)
+
+class Batched_Thompson_Sampling(AlgorithmBatched):
+    # one posterior sample per pull of the batch
+    def __init__(self, num_arms, horizon, batch_size, rng=None):
+        super().__init__(num_arms, horizon, batch_size, rng, allocation='sample')
+# END EDITING HERE
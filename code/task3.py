@@ -4,9 +4,10 @@ NOTE: You are only allowed to edit this file between the lines that say:
     # END EDITING HERE
 
 This file contains the AlgorithmManyArms class. Here are the method details:
-    - __init__(self, num_arms, horizon): This method is called when the class
-        is instantiated. Here, you can add any other member variables that you
-        need in your algorithm.
+    - __init__(self, num_arms, horizon, rng=None): This method is called when
+        the class is instantiated. Here, you can add any other member variables
+        that you need in your algorithm. rng is where random numbers come from,
+        np.random by default or a np.random.Generator.
     
     - give_pull(self): This method is called when the algorithm needs to
         select an arm to pull. The method should return the index of the arm
@@ -22,38 +23,115 @@ import numpy as np
 
 # START EDITING HERE
 # You can use this space to define any helper functions that you need
+
+# open-addressing hash table from arm index to (pulls, rewards), holding
+# only the arms that were actually pulled
+class ArmTable:
+    def __init__(self, capacity=64):
+        self.size = 0
+        self.allocate(capacity)
+
+    def allocate(self, capacity):
+        # capacity is kept a power of two so the hash can be masked
+        self.mask = capacity - 1
+        self.shift = 64 - capacity.bit_length() + 1
+        self.keys = np.full(capacity, -1, dtype=np.int64)
+        self.pulls = np.zeros(capacity)
+        self.rewards = np.zeros(capacity)
+
+    def slot(self, arm):
+        # fibonacci hashing, then linear probing until the arm or a hole
+        i = ((arm * 11400714819323198485) & 0xFFFFFFFFFFFFFFFF) >> self.shift
+        while True:
+            key = self.keys[i]
+            if key == arm or key == -1:
+                return i
+            i = (i + 1) & self.mask
+
+    def get(self, arm):
+        # returns (pulls, rewards), or None if the arm was never pulled
+        i = self.slot(arm)
+        if self.keys[i] == -1:
+            return None
+        return self.pulls[i], self.rewards[i]
+
+    def add(self, arm, pulls, reward):
+        i = self.slot(arm)
+        if self.keys[i] == -1:
+            if 2 * (self.size + 1) > len(self.keys):
+                # keep the load below one half, then probe again
+                self.grow()
+                i = self.slot(arm)
+            self.keys[i] = arm
+            self.size += 1
+        self.pulls[i] += pulls
+        self.rewards[i] += reward
+        return self.pulls[i], self.rewards[i]
+
+    def grow(self):
+        used = self.keys != -1
+        keys, pulls, rewards = self.keys[used], self.pulls[used], self.rewards[used]
+        self.allocate(2 * len(self.keys))
+        for arm, n, r in zip(keys.tolist(), pulls.tolist(), rewards.tolist()):
+            i = self.slot(arm)
+            self.keys[i], self.pulls[i], self.rewards[i] = arm, n, r
 # END EDITING HERE
 
 class AlgorithmManyArms:
-    def __init__(self, num_arms, horizon):
+    def __init__(self, num_arms, horizon, sparse=True, rng=None):
         self.num_arms = num_arms
         # Horizon is same as number of arms
         # START EDITING HERE
         # You can add any other variables you need here
-        self.pulls = np.zeros(self.num_arms)
-        self.rewards = np.zeros(self.num_arms)
+        # Generator calls it integers, np.random randint; arms are kept
+        # as python ints for the ArmTable hash
+        self.rng = np.random if rng is None else rng
+        randint = getattr(self.rng, 'integers', None) or self.rng.randint
+        self.randint = lambda high: int(randint(high))
+        # sparse keeps state only for pulled arms, in an ArmTable, so memory
+        # and setup grow with the number of pulls instead of num_arms
+        self.sparse = sparse
+        if sparse:
+            self.table = ArmTable()
+        else:
+            self.pulls = np.zeros(self.num_arms)
+            self.rewards = np.zeros(self.num_arms)
         # choosing factor to accept probability to some extent beyond maximum
-        self.exploit = 0.92 + np.random.random() / 20
+        self.exploit = 0.92 + self.rng.random() / 20
         self.thres = ((self.num_arms - 1) / self.num_arms) * self.exploit
         # recording the means and the current choice
-        self.means = np.ones(self.num_arms) * (self.num_arms - 1) / 2
-        self.optimal = np.random.randint(self.num_arms)
+        self.prior = (self.num_arms - 1) / 2
+        if not sparse:
+            self.means = np.ones(self.num_arms) * self.prior
+        self.optimal = self.randint(self.num_arms)
+        self.optimal_mean = self.prior
         # END EDITING HERE
     
     def give_pull(self):
         # START EDITING HERE
         # check if the current choice is within threshold
-        if self.means[self.optimal] >= self.thres:
+        if self.optimal_mean >= self.thres:
             return self.optimal
         # choose a new arm randomly
-        self.optimal = np.random.randint(self.num_arms)
+        self.optimal = self.randint(self.num_arms)
+        if self.sparse:
+            state = self.table.get(self.optimal)
+            self.optimal_mean = self.prior if state is None else state[1] / state[0]
+        else:
+            self.optimal_mean = self.means[self.optimal]
         return self.optimal
         # END EDITING HERE
     
     def get_reward(self, arm_index, reward):
         # START EDITING HERE
         # update the pulls and means and record reward obtained
-        self.pulls[arm_index] += 1
-        self.rewards[arm_index] += reward
-        self.means[arm_index] = self.rewards[arm_index] / self.pulls[arm_index]
+        if self.sparse:
+            pulls, rewards = self.table.add(arm_index, 1, reward)
+            mean = rewards / pulls
+        else:
+            self.pulls[arm_index] += 1
+            self.rewards[arm_index] += reward
+            mean = self.means[arm_index] = self.rewards[arm_index] / self.pulls[arm_index]
+        if arm_index == self.optimal:
+            self.optimal_mean = mean
         # END EDITING HERE
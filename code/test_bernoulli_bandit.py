@@ -0,0 +1,41 @@
+import numpy as np
+import bernoulli_bandit
+from bernoulli_bandit import UniformBandit
+
+# chi-square statistics a uniform distribution stays under with
+# probability 0.999, by degrees of freedom
+CHI2_999 = {9: 27.88, 19: 43.82, 99: 148.23}
+
+def best_positions(num_arms, num_seeds):
+  """counts of the index the best arm lands at, over seeds 0..num_seeds-1"""
+  counts = np.zeros(num_arms)
+  for seed in range(num_seeds):
+    bandit = UniformBandit(num_arms, seed)
+    means = [bandit.mean(i) for i in range(num_arms)]
+    counts[int(np.argmax(means))] += 1
+  return counts
+
+def chi2(counts):
+  expected = counts.sum() / len(counts)
+  return ((counts - expected) ** 2 / expected).sum()
+
+def test_means_are_a_permutation(monkeypatch):
+  for table_arms in [bernoulli_bandit.TABLE_ARMS, 0]:
+    monkeypatch.setattr(bernoulli_bandit, 'TABLE_ARMS', table_arms)
+    bandit = UniformBandit(100, 3)
+    means = sorted(bandit.mean(i) for i in range(100))
+    assert means == [i / 100 for i in range(100)]
+
+def test_best_position_is_uniform():
+  for num_arms in [10, 20]:
+    assert chi2(best_positions(num_arms, 10000)) < CHI2_999[num_arms - 1]
+
+def test_feistel_best_position_is_uniform(monkeypatch):
+  monkeypatch.setattr(bernoulli_bandit, 'TABLE_ARMS', 0)
+  for num_arms, num_seeds in [(20, 4000), (100, 4000)]:
+    assert chi2(best_positions(num_arms, num_seeds)) < CHI2_999[num_arms - 1]
+
+def test_seed_is_not_advanced():
+  seed = np.random.SeedSequence(7)
+  UniformBandit(10, seed)
+  assert seed.n_children_spawned == 0
@@ -0,0 +1,49 @@
+# regret trajectories
+# per-step cumulative regret of every replica, streamed by the workers into
+# one memory-mapped .npy file of shape (num_sims, horizon // stride)
+
+import numpy as np
+
+# samples a writer holds before copying them into the file
+BUFFER = 1 << 14
+
+def create_trajectories(path, num_sims, length):
+  """preallocates the file, row i is filled by replica i"""
+  out = np.lib.format.open_memmap(path, mode='w+', dtype=np.float64, shape=(num_sims, length))
+  out.flush()
+  del out
+
+def load_trajectories(path):
+  """read-only view of the file, slices are read from disk on access"""
+  return np.load(path, mmap_mode='r')
+
+def mean_trajectory(path, chunk=BUFFER):
+  """mean over replicas, reading chunk columns at a time"""
+  trajectories = load_trajectories(path)
+  mean = np.empty(trajectories.shape[1])
+  for start in range(0, len(mean), chunk):
+    mean[start:start + chunk] = trajectories[:, start:start + chunk].mean(axis=0)
+  return mean
+
+class TrajectoryWriter:
+  """appends samples to one row of the file, through a small buffer"""
+  def __init__(self, path, row):
+    self.path = path
+    self.row = row
+    self.buffer = []
+    self.written = 0
+
+  def append(self, value):
+    self.buffer.append(value)
+    if len(self.buffer) == BUFFER:
+      self.flush()
+
+  def flush(self):
+    if not self.buffer:
+      return
+    out = np.load(self.path, mmap_mode='r+')
+    out[self.row, self.written:self.written + len(self.buffer)] = self.buffer
+    out.flush()
+    del out
+    self.written += len(self.buffer)
+    self.buffer = []